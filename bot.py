@@ -1,24 +1,51 @@
+import asyncio
+import html
+import importlib
 import logging
 import os
-import re
+import time
 import traceback
-import requests
 from datetime import datetime
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
-from excel_reader import read_excel
-from content_writer import generate_post, paraphrase_caption
-from image_generator import compose_image, slugify
-from wp_poster import upload_featured_image, get_media_url, post_to_wordpress
-from gemini_extract_team import extract_teams_from_url
-from bs4 import BeautifulSoup
+from excel_reader import read_accounts, iter_keywords, count_keyword_rows, normalize_website, ExcelFormatError
+from content_writer import (
+    generate_post, generate_post_bundle, POST_MODEL
+)
+from render_pool import RenderJob, get_render_pool
+from wp_poster import get_client
+from gemini_extract_team import extract_teams_from_url, TEAM_MODEL
+from gemini_client import get_gemini_client, summarize_usage
+from result_cache import get_cache
+from job_journal import get_journal, file_hash, reached
+from notifier import ProgressNotifier
+from stage_graph import StageGraph
+from index_queue import get_index_queue
+from metrics import metrics, METRICS_PROM_FILE
+from html_post import postprocess_html, slugify
+from caption_engine import get_caption_engine
+from job_manager import get_job_manager, new_job_dir, JobCancelled
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 SINBYTE_API_KEY = os.getenv('SINBYTE_API_KEY')
 
-logging.basicConfig(level=logging.INFO)
+# Số dòng key_word xử lý đồng thời, và giới hạn đồng thời theo website / model Gemini
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))
+MAX_PER_WEBSITE = int(os.getenv('MAX_PER_WEBSITE', '2'))
+GEMINI_MODEL_LIMITS = {
+    'gemini-2.5-pro': int(os.getenv('GEMINI_PRO_CONCURRENCY', '2')),
+    'gemini-2.5-flash': int(os.getenv('GEMINI_FLASH_CONCURRENCY', '4')),
+}
+
+# 1 = gọi Gemini một lần (JSON) lấy đội + bài + caption, lỗi thì quay về luồng nhiều lần gọi
+GEMINI_COMBINED = os.getenv('GEMINI_COMBINED', '1') == '1'
+
+_website_semaphores = {}
+_model_semaphores = {}
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 def create_wp_figure_html(img_url, alt, caption, width=800, height=450, img_id=None):
     img_class = f"size-full wp-image-{img_id}" if img_id else "size-full"
@@ -34,221 +61,528 @@ def create_wp_figure_html(img_url, alt, caption, width=800, height=450, img_id=N
     )
     return html_fig
 
-def remove_all_entities(raw_html):
-    return re.sub(r'&[a-zA-Z0-9#]+;', '', raw_html)
-
-def insert_figures_after_h2s(html_content, img2_html, img3_html, bot=None, chat_id=None):
-    try:
-        html_content = remove_all_entities(html_content)
-        soup = BeautifulSoup(html_content, "lxml")
-        h2s = soup.find_all('h2')
-        if len(h2s) >= 1 and img2_html:
-            h2s[0].insert_after(BeautifulSoup(img2_html, "lxml"))
-        if h2s and img3_html:
-            h2s[-1].insert_after(BeautifulSoup(img3_html, "lxml"))
-        if soup.body:
-            return soup.body.decode_contents()
-        return str(soup)
-    except Exception as e:
-        error_msg = f"[ERROR] insert_figures_after_h2s: {e}\n"
-        error_msg += traceback.format_exc()
-        error_msg += f"\n------\n[INPUT HTML]:\n{html_content}\n------\n"
-        print(error_msg)
-        if bot and chat_id:
-            short_err = error_msg[:4000]
-            bot.send_message(chat_id, f"❌ [DEBUG] Lỗi BeautifulSoup:\n<pre>{short_err}</pre>", parse_mode="HTML")
-        return f"[ERROR] insert_figures_after_h2s: {e}"
-
-def submit_index_sinbyte(api_key, post_urls, name=None, dripfeed=1):
-    url = "https://app.sinbyte.com/api/indexing/"
-    headers = {"Content-Type": "application/json"}
-    if name is None:
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        name = f"Nordic {current_time}"
-    data = {
-        "apikey": api_key,
-        "name": name,
-        "dripfeed": dripfeed,
-        "urls": post_urls if isinstance(post_urls, list) else [post_urls]
-    }
-    try:
-        resp = requests.post(url, headers=headers, json=data, timeout=30)
-        return resp.status_code, resp.text
-    except Exception as e:
-        return 0, str(e)
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🐣 Gửi file Excel chứa dữ liệu để đăng bài nhé~")
 
+async def cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /cache                 -> thống kê cache kết quả Gemini
+    /cache list [url]      -> các entry mới nhất (lọc theo url nguồn)
+    /cache purge [url|all] -> xoá cache (bài, tên đội, caption) của một url nguồn, hoặc toàn bộ; kèm các entry hết hạn
+    """
+    cache = get_cache()
+    if cache is None:
+        await update.message.reply_text("⚠️ Cache kết quả Gemini đang tắt (RESULT_CACHE_PATH rỗng).")
+        return
+    args = context.args or []
+    action = args[0].lower() if args else "stats"
+    url = args[1] if len(args) > 1 else None
+    if action == "list":
+        rows = await asyncio.to_thread(cache.entries, url)
+        if not rows:
+            await update.message.reply_text("📭 Không có entry nào.")
+            return
+        lines = [
+            f"• {kind} | {src or '-'} | {datetime.fromtimestamp(created):%Y-%m-%d %H:%M}"
+            for kind, src, created, accessed in rows
+        ]
+        await update.message.reply_text("\n".join(lines)[:4000])
+    elif action == "purge":
+        if url is None:
+            await update.message.reply_text("Dùng: /cache purge <url nguồn> hoặc /cache purge all")
+            return
+        removed = await asyncio.to_thread(cache.purge, None if url == "all" else url)
+        expired = await asyncio.to_thread(cache.purge_expired)
+        await update.message.reply_text(f"🧹 Đã xoá {removed} entry" + (f" và {expired} entry hết hạn." if expired else "."))
+    else:
+        stats = await asyncio.to_thread(cache.stats)
+        by_kind = ", ".join(f"{k}: {v}" for k, v in stats['by_kind'].items()) or "-"
+        await update.message.reply_text(
+            f"🗃 Cache Gemini: {stats['entries']} entry ({by_kind}), {stats['size_bytes'] / 1024:.0f} KB\n"
+            f"Hit/miss từ lúc khởi động: {stats['hits']}/{stats['misses']}"
+        )
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /stats       -> độ trễ từng stage, retry, token theo model / website
+    /stats prom  -> số liệu dạng Prometheus text
+    """
+    args = context.args or []
+    if args and args[0].lower() == "prom":
+        text = metrics.to_prometheus()
+        await update.message.reply_text(text[-4000:])
+        return
+    await update.message.reply_text(metrics.summary_text()[:4000])
+
+async def index_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /index        -> số link trong hàng đợi ép index Sinbyte theo trạng thái
+    /index retry  -> đưa các link failed (hết lượt thử) về hàng đợi và gửi ngay
+    """
+    queue = get_index_queue()
+    args = context.args or []
+    if args and args[0].lower() == "retry":
+        requeued = await asyncio.to_thread(queue.retry_failed)
+        results = await asyncio.to_thread(queue.flush, True)
+        sent = sum(count for _, count, ok, _ in results if ok)
+        await update.message.reply_text(f"🔁 Đưa lại {requeued} link failed vào hàng đợi, đã gửi thành công {sent} link.")
+        return
+    stats = await asyncio.to_thread(queue.stats)
+    text = ", ".join(f"{status}: {n}" for status, n in sorted(stats.items())) or "trống"
+    await update.message.reply_text(
+        f"📨 Hàng đợi index Sinbyte: {text}"
+        + ("" if SINBYTE_API_KEY else "\n⚠️ Chưa có SINBYTE_API_KEY, link chỉ được giữ trong hàng đợi.")
+    )
+
 async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     file = update.message.document
     chat_id = update.effective_chat.id
     if file.file_name.endswith('.xlsx'):
         file_obj = await file.get_file()
-        os.makedirs("tmp", exist_ok=True)
-        local_path = f"tmp/{file.file_name}"
+        local_path = os.path.join(new_job_dir(chat_id), os.path.basename(file.file_name))
         await file_obj.download_to_drive(local_path)
-        await context.bot.send_message(chat_id, "📦 Đã nhận file, bắt đầu xử lý nhé! 💪")
-        await process_excel(local_path, update, context)
+        manager = get_job_manager()
+        job_id = await asyncio.to_thread(manager.submit, chat_id, file.file_name, local_path)
+        ahead = await asyncio.to_thread(manager.queue_position, job_id)
+        duplicate = await asyncio.to_thread(manager.duplicate_of, job_id)
+        await context.bot.send_message(
+            chat_id,
+            f"📦 Đã nhận file, xếp hàng job #{job_id}"
+            + (f" (còn {ahead} job chờ trước)" if ahead else "")
+            + (f". File trùng với job #{duplicate}: chạy sau khi job đó xong, chỉ làm các dòng chưa đăng" if duplicate else "")
+            + f". Xem /status {job_id}, huỷ bằng /cancel {job_id} 💪"
+        )
     else:
         await context.bot.send_message(chat_id, "⚠️ Chỉ nhận file .xlsx thôi nha~ 😽")
 
-async def process_excel(file_path, update, context):
-    chat_id = update.effective_chat.id
+JOB_STATUS_TEXT = {
+    'queued': '⏳ đang chờ',
+    'running': '🏃 đang chạy',
+    'done': '✅ xong',
+    'failed': '❌ lỗi',
+    'cancelled': '🛑 đã huỷ',
+}
+
+def _job_id_arg(context):
     try:
-        await context.bot.send_message(chat_id, "📖 Đang đọc file Excel... ⏳")
-        accounts, keywords = read_excel(file_path)
-        await context.bot.send_message(chat_id, "🍀 Đã đọc xong file Excel. Bắt đầu xử lý từng dòng key_word! 🚀")
-
-        website_links = dict()  # {website: [post_link, ...]}
-
-        for idx, row in keywords.iterrows():
-            try:
-                await context.bot.send_message(
-                    chat_id,
-                    f"\n---\n📝 Xử lý dòng {idx+2}:\n<code>{dict(row)}</code>",
-                    parse_mode="HTML"
-                )
+        return int((context.args or [""])[0].lstrip("#"))
+    except ValueError:
+        return None
+
+async def _own_job(update, context, usage):
+    job_id = _job_id_arg(context)
+    if job_id is None:
+        await update.message.reply_text(f"Dùng: {usage}")
+        return None
+    job = await asyncio.to_thread(get_job_manager().get, job_id)
+    if job is None or job['chat_id'] != update.effective_chat.id:
+        await update.message.reply_text(f"Không tìm thấy job #{job_id} của chat này.")
+        return None
+    return job
+
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /jobs -> các job gần nhất của chat này
+    """
+    jobs = await asyncio.to_thread(get_job_manager().jobs, update.effective_chat.id)
+    if not jobs:
+        await update.message.reply_text("Chưa có job nào. Gửi file .xlsx để bắt đầu.")
+        return
+    lines = [
+        f"#{job['id']} {JOB_STATUS_TEXT.get(job['status'], job['status'])} — {job['file_name']} "
+        f"({datetime.fromtimestamp(job['created']):%d/%m %H:%M})"
+        for job in jobs
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /status <id> -> trạng thái + tiến độ của job
+    """
+    job = await _own_job(update, context, "/status <id job>")
+    if job is None:
+        return
+    manager = get_job_manager()
+    text = f"Job #{job['id']} {JOB_STATUS_TEXT.get(job['status'], job['status'])} — {job['file_name']}"
+    if job['status'] == 'queued':
+        ahead = await asyncio.to_thread(manager.queue_position, job['id'])
+        text += f"\nCòn {ahead} job chờ trước."
+    if job['error']:
+        text += f"\nLỗi: {job['error']}"
+    running = manager.running(job['id'])
+    if running is not None and running.notify is not None:
+        await update.message.reply_text(f"{html.escape(text)}\n\n{running.notify.render()}"[:4000], parse_mode="HTML")
+        return
+    await update.message.reply_text(text)
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /cancel <id> -> huỷ job đang chờ, hoặc dừng job đang chạy sau stage hiện tại của các dòng
+    """
+    job = await _own_job(update, context, "/cancel <id job>")
+    if job is None:
+        return
+    previous = get_job_manager().cancel(job['id'])
+    if previous == 'queued':
+        await update.message.reply_text(f"🛑 Đã huỷ job #{job['id']}.")
+    elif previous == 'running':
+        await update.message.reply_text(f"🛑 Đang dừng job #{job['id']}, các dòng đang chạy dừng sau stage hiện tại.")
+    else:
+        await update.message.reply_text(f"Job #{job['id']} đã {JOB_STATUS_TEXT.get(previous, previous)}, không cần huỷ.")
+
+def _limiter(store, key, limit):
+    # Semaphore dùng chung giữa các job, tạo lười theo key (website / model)
+    sem = store.get(key)
+    if sem is None:
+        sem = store[key] = asyncio.Semaphore(max(1, limit))
+    return sem
+
+async def run_gemini(stage, model_name, func, *args, usage, website=None):
+    # func(*args, usage); metric ghi theo model đã trả lời thật (model dự phòng nếu model chính hết quota)
+    limit = GEMINI_MODEL_LIMITS.get(model_name, 2)
+    async with _limiter(_model_semaphores, model_name, limit):
+        calls = len(usage)
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = await asyncio.to_thread(func, *args, usage)
+            ok = True
+            return result
+        finally:
+            answered = usage[-1]['model'] if len(usage) > calls else model_name
+            metrics.observe(stage, time.perf_counter() - started, ok, model=answered, website=website)
+
+async def process_row(row, accounts, notify, fhash, job=None):
+    """
+    Xử lý một dòng key_word: lấy tên đội, viết bài, tạo ảnh, upload và đăng bài.
+    Mỗi mốc xong được ghi vào job journal, chạy lại file thì tiếp tục từ mốc cuối cùng.
+    Tiến độ / lỗi báo qua notify (ProgressNotifier), không chờ gửi Telegram.
+    Job bị /cancel thì dừng ở điểm kiểm tra giữa các stage (ném JobCancelled).
+    Trả về (website, post_link) nếu đăng thành công, ngược lại None.
+    """
+    idx = row.row_number - 2
+    tag = f"[Dòng {row.row_number}]"
+    journal = get_journal()
+    usage = []  # token + thời gian từng lần gọi Gemini của dòng này
+    try:
+        stage, state = await asyncio.to_thread(journal.get, fhash, idx)
+        if reached(stage, 'published'):
+            notify.row_skipped(row.row_number)
+            await asyncio.to_thread(get_index_queue().enqueue, state['website'], state['post_link'])
+            return state['website'], state['post_link']
+
+        if row.error:
+            notify.row_failed(row.row_number, row.error)
+            return None
+
+        notify.row_started(row.row_number)
+        logging.info("%s Bắt đầu xử lý%s: %s", tag, f" (tiếp từ mốc {stage})" if stage else "", row._asdict())
+
+        src_url = row.src_url
+        website = row.website
+        cat_id = row.cat_id
+        anchor_text = row.anchor_text
+        anchor_url = row.anchor_url
 
-                src_url = row['url bài viết nguồn']
-                website = row['website cần đăng']
-                cat_id = int(row['id chuyên mục cần đăng'])
-                anchor_text = row['anchor text']
-                anchor_url = row['url anchor text']
+        account = accounts.get(normalize_website(website))
+        if account is None:
+            notify.row_failed(row.row_number, f"Không tìm thấy account cho website {website}")
+            return None
+        wp_url = account.website
+        wp_user = account.username
+        wp_pass = account.password
+        logo_bg = account.background
 
-                # === Thử lấy tên 2 đội tối đa 3 lần ===
-                team_home, team_away = None, None
-                last_err = ""
-                for retry in range(3):
+        if job:
+            job.check()
+        bundle = None
+        if reached(stage, 'post'):
+            team_home, team_away = state['team_home'], state['team_away']
+            h1_title, h2s_list, post_content = state['h1'], state['h2s'], state['html']
+            bundle = state.get('bundle')
+        else:
+            if GEMINI_COMBINED:
+                bundle = await run_gemini('generate', POST_MODEL, generate_post_bundle, src_url, anchor_text, anchor_url, usage=usage, website=website)
+
+            if bundle:
+                team_home, team_away = bundle['team_home'], bundle['team_away']
+                h1_title, h2s_list, post_content = bundle['h1'], bundle['h2s'], bundle['html']
+                notify.stage(row.row_number, 'teams')
+            else:
+                if reached(stage, 'teams'):
+                    team_home, team_away = state['team_home'], state['team_away']
+                else:
+                    # Thử lại 429/503/timeout đã nằm trong gemini_client
                     try:
-                        team_home, team_away = extract_teams_from_url(src_url)
-                        if team_home and team_away:
-                            break
+                        team_home, team_away = await run_gemini('teams', TEAM_MODEL, extract_teams_from_url, src_url, usage=usage, website=website)
                     except Exception as e:
-                        last_err = e
-                if not team_home or not team_away:
-                    await context.bot.send_message(
-                        chat_id,
-                        f"😢 Lỗi dùng Gemini lấy tên hai đội (thử 3 lần): <code>{last_err}</code>",
-                        parse_mode="HTML"
+                        notify.row_failed(row.row_number, f"Lỗi dùng Gemini lấy tên hai đội: {e}")
+                        return None
+                    await asyncio.to_thread(
+                        journal.record, fhash, idx, 'teams', team_home=team_home, team_away=team_away
                     )
-                    continue
-
-                await context.bot.send_message(
-                    chat_id,
-                    f"✅ Hai đội xác định: <b>{team_home}</b> vs <b>{team_away}</b>",
-                    parse_mode="HTML"
-                )
+                notify.stage(row.row_number, 'teams')
 
-                acc_row = accounts[accounts['website'] == website]
-                if acc_row.empty:
-                    await context.bot.send_message(
-                        chat_id,
-                        f"😥 Lỗi: Không tìm thấy account cho website <b>{website}</b> ở dòng {idx+2}",
-                        parse_mode="HTML"
-                    )
-                    continue
-                acc_row = acc_row.iloc[0]
-                wp_url = acc_row['website']
-                wp_user = acc_row['tài khoản']
-                wp_pass = acc_row['mật khẩu']
-                logo_bg = acc_row['background ảnh']
-
-                await context.bot.send_message(
-                    chat_id,
-                    f"🤖 Gọi Gemini viết bài và lấy H1, H2, anchor: <b>{anchor_text}</b> 🪄",
-                    parse_mode="HTML"
-                )
                 try:
-                    h1_title, h2s_list, post_content = generate_post(src_url, anchor_text, anchor_url)
-                    if not h1_title:
-                        await context.bot.send_message(
-                            chat_id,
-                            "⚠️ Không tìm thấy tiêu đề 1 (H1) trong bài viết của Gemini!",
-                            parse_mode="HTML"
-                        )
-                        continue
-                    await context.bot.send_message(
-                        chat_id,
-                        f"🌸 Đã tách tiêu đề 1: <b>{h1_title}</b> và H2s: <b>{h2s_list}</b>!",
-                        parse_mode="HTML"
+                    h1_title, h2s_list, post_content = await run_gemini(
+                        'generate', POST_MODEL, generate_post, src_url, anchor_text, anchor_url, usage=usage, website=website
                     )
+                    if not h1_title:
+                        notify.row_failed(row.row_number, "Không tìm thấy tiêu đề 1 (H1) trong bài viết của Gemini!")
+                        return None
                 except Exception as e:
-                    await context.bot.send_message(
-                        chat_id,
-                        f"💔 Lỗi khi gọi Gemini hoặc tách tiêu đề 1: <code>{e}</code>",
-                        parse_mode="HTML"
-                    )
-                    continue
+                    notify.row_failed(row.row_number, f"Lỗi khi gọi Gemini hoặc tách tiêu đề 1: {e}")
+                    return None
 
-                # ==== ĐẶT TÊN ẢNH ĐÚNG YÊU CẦU ====
-                img1_name = f"tmp/thumbnail-{slugify(h1_title)}.jpg"
-                img2_text = h2s_list[0] if len(h2s_list) >= 1 else ""
-                img3_text = h2s_list[-1] if len(h2s_list) >= 1 else ""
+            await asyncio.to_thread(
+                journal.record, fhash, idx, 'post',
+                team_home=team_home, team_away=team_away,
+                h1=h1_title, h2s=h2s_list, html=post_content, bundle=bundle
+            )
+        notify.stage(row.row_number, 'post')
+        if job:
+            job.check()
+        logging.info("%s %s vs %s — H1: %s, H2s: %s", tag, team_home, team_away, h1_title, h2s_list)
 
-                alt2 = caption2 = paraphrase_caption(img2_text, team_home, team_away) if img2_text else ""
-                alt3 = caption3 = paraphrase_caption(img3_text, team_home, team_away) if img3_text else ""
+        img2_text = h2s_list[0] if len(h2s_list) >= 1 else ""
+        img3_text = h2s_list[-1] if len(h2s_list) >= 1 else ""
+
+        wp = get_client(wp_url, wp_user, wp_pass)
+        if reached(stage, 'images'):
+            thumb_id = state['thumb_id']
+            img2_id, img2_url, caption2 = state['img2_id'], state['img2_url'], state['caption2']
+            img3_id, img3_url, caption3 = state['img3_id'], state['img3_url'], state['caption3']
+        else:
+            # Caption, render và upload của 3 ảnh chạy theo đồ thị phụ thuộc:
+            # render không cần chờ caption, upload ảnh 2/3 chỉ chờ render + caption của chính nó.
+            # Mỗi ảnh upload xong được ghi ngay (id, url, caption) vào journal, chạy lại thì dùng lại, không upload trùng.
+            async def make_caption(key, text, bundle_caption):
+                if key in state:
+                    return state[key]
+                if not text:
+                    return ""
+                if bundle_caption:
+                    return bundle_caption
+                # Gom chung batch với caption của các dòng khác đang chạy
+                return await get_caption_engine().caption(text, team_home, team_away, usage, src_url)
 
-                img2_name = f"tmp/{slugify(caption2)}.jpg" if caption2 else None
-                img3_name = f"tmp/{slugify(caption3)}.jpg" if caption3 else None
+            async def render(key, text):
+                if not text or key in state:
+                    return None
+                with metrics.timer('render', website=website):
+                    return await get_render_pool().render(RenderJob(logo_bg, text))
 
-                compose_image(logo_bg, h1_title, img1_name)
-                if img2_name: compose_image(logo_bg, img2_text, img2_name)
-                if img3_name: compose_image(logo_bg, img3_text, img3_name)
+            async def upload(key, data, file_name, alt_text, **extra):
+                if key in state:
+                    return tuple(state[key])
+                if data is None:
+                    return None, ""
+                # Upload thẳng bytes JPEG từ pool render, file_name chỉ là tên ảnh trên WP
+                async with _limiter(_website_semaphores, wp_url, MAX_PER_WEBSITE):
+                    with metrics.timer('upload', website=website):
+                        media_id, media_url = await asyncio.to_thread(wp.upload_media, data, alt_text, file_name)
+                await asyncio.to_thread(journal.record, fhash, idx, 'post', **{key: [media_id, media_url]}, **extra)
+                return media_id, media_url
 
-                thumb_id = upload_featured_image(wp_url, wp_user, wp_pass, img1_name, h1_title)
-                img2_id = upload_featured_image(wp_url, wp_user, wp_pass, img2_name, img2_text) if img2_name else None
-                img3_id = upload_featured_image(wp_url, wp_user, wp_pass, img3_name, img3_text) if img3_name else None
+            graph = StageGraph(tag)
+            graph.add('caption2', lambda: make_caption('caption2', img2_text, bundle and bundle['caption_first']))
+            graph.add('caption3', lambda: make_caption('caption3', img3_text, bundle and bundle['caption_last']))
+            graph.add('render1', lambda: render('upload1', h1_title))
+            graph.add('render2', lambda: render('upload2', img2_text))
+            graph.add('render3', lambda: render('upload3', img3_text))
+            graph.add('upload1', lambda render1: upload('upload1', render1, f"thumbnail-{slugify(h1_title)}.jpg", h1_title),
+                      deps=('render1',))
+            graph.add('upload2', lambda render2, caption2: upload(
+                          'upload2', render2 if caption2 else None, f"{slugify(caption2)}.jpg", img2_text, caption2=caption2),
+                      deps=('render2', 'caption2'))
+            graph.add('upload3', lambda render3, caption3: upload(
+                          'upload3', render3 if caption3 else None, f"{slugify(caption3)}.jpg", img3_text, caption3=caption3),
+                      deps=('render3', 'caption3'))
+            results = await graph.run()
 
-                img2_url = get_media_url(wp_url, img2_id, wp_user, wp_pass) if img2_id else ""
-                img3_url = get_media_url(wp_url, img3_id, wp_user, wp_pass) if img3_id else ""
+            caption2, caption3 = results['caption2'], results['caption3']
+            thumb_id, _ = results['upload1']
+            img2_id, img2_url = results['upload2']
+            img3_id, img3_url = results['upload3']
 
-                img2_html = create_wp_figure_html(img2_url, alt2, caption2, 800, 450, img2_id) if img2_url else ""
-                img3_html = create_wp_figure_html(img3_url, alt3, caption3, 800, 450, img3_id) if img3_url else ""
+            await asyncio.to_thread(
+                journal.record, fhash, idx, 'images',
+                thumb_id=thumb_id, img2_id=img2_id, img2_url=img2_url, caption2=caption2,
+                img3_id=img3_id, img3_url=img3_url, caption3=caption3
+            )
+        notify.stage(row.row_number, 'images')
+        if job:
+            job.check()
+        alt2, alt3 = caption2, caption3
 
-                html_with_figures = insert_figures_after_h2s(post_content, img2_html, img3_html, context.bot, chat_id)
+        img2_html = create_wp_figure_html(img2_url, alt2, caption2, 800, 450, img2_id) if img2_url else ""
+        img3_html = create_wp_figure_html(img3_url, alt3, caption3, 800, 450, img3_id) if img3_url else ""
 
-                post_link = post_to_wordpress(
-                    wp_url, wp_user, wp_pass,
+        with metrics.timer('html', website=website):
+            html_with_figures = postprocess_html(post_content, anchor_text, anchor_url, img2_html, img3_html)
+
+        async with _limiter(_website_semaphores, wp_url, MAX_PER_WEBSITE):
+            with metrics.timer('publish', website=website):
+                post_link = await asyncio.to_thread(
+                    wp.create_post,
                     html_with_figures, cat_id, h1_title,
                     featured_media_id=thumb_id
                 )
-                await context.bot.send_message(
-                    chat_id,
-                    f"🎉✅ Đăng bài thành công cho <b>{h1_title}</b> lên <b>{website}</b>!\n🔗 Link bài viết: {post_link} 🦄",
-                    parse_mode="HTML"
-                )
+        await asyncio.to_thread(
+            journal.record, fhash, idx, 'published', website=website, post_link=post_link
+        )
+        await asyncio.to_thread(get_index_queue().enqueue, website, post_link)
+        notify.stage(row.row_number, 'published')
+        notify.row_done(row.row_number, post_link)
+        logging.info("%s Đăng bài thành công lên %s: %s (%s, %s)", tag, website, post_link,
+                     "combined" if bundle else "multi-call", summarize_usage(usage))
+        return website, post_link
+
+    except JobCancelled:
+        notify.row_failed(row.row_number, "Đã huỷ (chạy lại file sẽ tiếp tục từ mốc đã xong)")
+        return None
+    except Exception as e:
+        notify.row_failed(row.row_number, f"Lỗi không xác định: {e}")
+        logging.exception("%s Lỗi không xác định", tag)
+        return None
+    finally:
+        for u in usage:
+            metrics.record_tokens(u['model'], u['prompt_tokens'], u['output_tokens'], row.website)
+
+async def process_excel(file_path, bot, chat_id, job=None, map_account=None):
+    """
+    Chạy toàn bộ một file Excel (một job trong JobManager), báo tiến độ về chat_id.
+    map_account(Account) -> Account: sửa account trước khi chạy (dry_run trỏ website / ảnh nền về server giả)
+    """
+    notify = None
+    try:
+        try:
+            accounts = await asyncio.to_thread(read_accounts, file_path)
+            if map_account:
+                accounts = {key: map_account(acc) for key, acc in accounts.items()}
+            total = await asyncio.to_thread(count_keyword_rows, file_path)
+        except ExcelFormatError as e:
+            await bot.send_message(chat_id, f"⚠️ File Excel sai định dạng: {e}")
+            raise
+        fhash = await asyncio.to_thread(file_hash, file_path)
+        get_render_pool(warm_backgrounds={acc.background for acc in accounts.values() if acc.background})
+
+        title = f"{job.file_name} (job #{job.id})" if job else os.path.basename(file_path)
+        notify = ProgressNotifier(bot, chat_id, f"{title} — {MAX_WORKERS} dòng song song", total)
+        if job:
+            job.notify = notify
+        await notify.start()
+
+        # Đọc dần sheet key_word: worker lấy dòng nào xử lý dòng đó, không chờ đọc hết file
+        keyword_rows = iter_keywords(file_path)
+        read_lock = asyncio.Lock()
+        post_links = []  # link bài của job này, chỉ ép index các link này khi xong file
+
+        async def next_row():
+            async with read_lock:
+                return await asyncio.to_thread(next, keyword_rows, None)
+
+        async def worker():
+            while not (job and job.cancelled):
+                row = await next_row()
+                if row is None:
+                    return
+                posted = await process_row(row, accounts, notify, fhash, job)
+                if posted:
+                    post_links.append(posted[1])
 
-                website_links.setdefault(website, []).append(post_link)
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, MAX_WORKERS))))
+        except ExcelFormatError as e:
+            notify.info(f"⚠️ File Excel sai định dạng: {html.escape(str(e))}")
+            await notify.close()
+            raise
 
-            except Exception as e:
-                err_msg = f"❌ Lỗi không xác định dòng {idx+2}: {e}\n{traceback.format_exc()}"
-                await context.bot.send_message(chat_id, err_msg[:4000], parse_mode="HTML")
-                print(err_msg)
+        if job and job.cancelled:
+            await notify.close(f"🛑 Đã huỷ job #{job.id}. Gửi lại file để chạy tiếp các dòng còn lại.")
+            return
 
-        # ====== ÉP INDEX SINBYTE THEO WEBSITE ==========
+        # ====== ÉP INDEX SINBYTE: gửi nốt các link của job này còn trong hàng đợi (lỗi sẽ được thử lại ở nền) ==========
         if SINBYTE_API_KEY:
-            for web, links in website_links.items():
-                if links:
-                    await context.bot.send_message(chat_id, f"⏳ Đang gửi ép index {len(links)} link qua Sinbyte cho website <b>{web}</b> ...")
-                    status, sinbyte_resp = submit_index_sinbyte(SINBYTE_API_KEY, links, name=f"{web} {datetime.now():%Y-%m-%d %H:%M:%S}")
-                    if status == 200:
-                        await context.bot.send_message(chat_id, f"✅ Đã ép index thành công qua Sinbyte cho <b>{web}</b>!")
-                    else:
-                        await context.bot.send_message(chat_id, f"❌ Sinbyte index fail ({status}) cho <b>{web}</b>: {sinbyte_resp[:4000]}")
+            for web, count, ok, sinbyte_resp in await asyncio.to_thread(get_index_queue().flush, True, post_links):
+                if ok:
+                    notify.info(f"✅ Đã ép index {count} link thành công qua Sinbyte cho <b>{html.escape(web)}</b>!")
+                else:
+                    notify.info(f"❌ Sinbyte index fail cho <b>{html.escape(web)}</b> ({count} link, sẽ thử lại): "
+                                f"{html.escape(sinbyte_resp[:3000])}")
         else:
-            await context.bot.send_message(chat_id, f"⚠️ Không có SINBYTE_API_KEY!")
+            notify.info("⚠️ Không có SINBYTE_API_KEY! Link đã đăng được giữ trong hàng đợi index.")
 
-        await context.bot.send_message(chat_id, "✨ Đã xử lý xong toàn bộ file. Cảm ơn bạn! 🥰")
+        await notify.close("✨ Đã xử lý xong toàn bộ file. Cảm ơn bạn! 🥰")
+    except ExcelFormatError:
+        # Đã báo lỗi định dạng cho chat, ném tiếp để JobManager ghi job 'failed'
+        raise
     except Exception as e:
         err_msg = f"❌ Lỗi tổng khi xử lý file: {e}\n{traceback.format_exc()}"
-        await context.bot.send_message(chat_id, err_msg[:4000], parse_mode="HTML")
-        print(err_msg)
+        if notify:
+            await notify.close()
+        await bot.send_message(chat_id, err_msg[:4000])
+        logging.error(err_msg)
+        raise
+
+async def _export_metrics(interval=30):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(metrics.write_prometheus)
+        except OSError:
+            logging.exception("Không ghi được file metrics Prometheus")
+
+# Module nặng chỉ cần khi có file Excel: nạp nền sau khi bot đã nhận tin, không chặn lúc khởi động.
+# image_generator (Pillow) không có ở đây: chỉ process render (render_pool) mới cần nạp
+WARMUP_MODULES = ('openpyxl', 'markdown2')
+
+async def _warm_up(delay=1.0):
+    await asyncio.sleep(delay)  # nhường cho run_polling bắt đầu nhận update trước
+
+    def load():
+        started = time.perf_counter()
+        for name in WARMUP_MODULES:
+            importlib.import_module(name)
+        warm = getattr(get_gemini_client().backend, 'warm_up', None)
+        if warm:
+            warm()
+        logging.info("Warm-up xong trong %.2fs", time.perf_counter() - started)
+
+    try:
+        await asyncio.to_thread(load)
+    except Exception:
+        logging.exception("Warm-up lỗi (module sẽ được nạp khi cần)")
+
+async def post_init(app):
+    # Entry cache hết hạn chỉ bị xoá khi được đọc lại: dọn một lượt lúc khởi động
+    cache = get_cache()
+    if cache:
+        expired = await asyncio.to_thread(cache.purge_expired)
+        if expired:
+            logging.info("Đã xoá %d entry cache Gemini hết hạn", expired)
+    # Hàng đợi ép index chạy nền: gửi batch đến hạn và thử lại các lần gửi lỗi
+    if SINBYTE_API_KEY:
+        app.create_task(get_index_queue().run())
+    if METRICS_PROM_FILE:
+        app.create_task(_export_metrics())
+    app.create_task(_warm_up())
+    # Hàng đợi file Excel: chạy lại cả các job còn dang dở từ lần chạy trước
+    app.create_task(get_job_manager().run(
+        lambda job: process_excel(job.file_path, app.bot, job.chat_id, job)
+    ))
 
 def main():
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
     app.add_handler(CommandHandler("start", start))
-    app.add_handler(MessageHandler(filters.Document.ALL, handle_file))
+    app.add_handler(CommandHandler("cache", cache_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("index", index_command))
+    app.add_handler(CommandHandler("jobs", jobs_command))
+    app.add_handler(CommandHandler("status", status_command))
+    app.add_handler(CommandHandler("cancel", cancel_command))
+    # block=False: tải file + xếp hàng chạy nền, job chạy trong JobManager
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_file, block=False))
     app.run_polling()
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+from content_writer import paraphrase_caption, paraphrase_captions, CAPTION_MODEL
+from metrics import metrics
+
+CAPTION_BATCH_SIZE = int(os.getenv('CAPTION_BATCH_SIZE', '20'))
+# Giây chờ gom thêm caption từ các dòng khác trước khi gửi batch chưa đầy
+CAPTION_BATCH_WAIT = float(os.getenv('CAPTION_BATCH_WAIT', '0.5'))
+
+
+def _split_usage(batch_usage, n):
+    """
+    Chia đều token của một lần gọi batch cho n caption (để thống kê theo dòng / website vẫn cộng đúng tổng)
+    """
+    shares = [[] for _ in range(n)]
+    for u in batch_usage:
+        for i, share in enumerate(shares):
+            share.append({
+                key: (value if key == 'model' else
+                      value / n if key == 'seconds' else
+                      value // n + (1 if i < value % n else 0))
+                for key, value in u.items()
+            })
+    return shares
+
+
+class CaptionEngine:
+    """
+    Gom yêu cầu caption (H2, đội nhà, đội khách) từ nhiều bài đang chạy song song thành batch
+    CAPTION_BATCH_SIZE caption / một lần gọi Gemini; mục nào batch không trả về thì gọi riêng paraphrase_caption.
+    """
+
+    def __init__(self, batch_size=CAPTION_BATCH_SIZE, max_wait=CAPTION_BATCH_WAIT):
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._pending = []  # [((h2, home, away), future, usage, url nguồn)]
+        self._timer = None
+
+    async def caption(self, h2_text, team_home, team_away, usage=None, source_url=""):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((h2_text, team_home, team_away), future, usage, source_url))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        items = [item for item, _, _, _ in batch]
+        source_urls = [source_url for _, _, _, source_url in batch]
+        batch_usage = []
+        try:
+            with metrics.timer('caption', model=CAPTION_MODEL):
+                results = await asyncio.to_thread(paraphrase_captions, items, batch_usage, source_urls)
+        except Exception:
+            logging.exception("Batch caption lỗi")
+            results = [None] * len(batch)
+        metrics.inc('caption_batches')
+        for (_, _, usage, _), share in zip(batch, _split_usage(batch_usage, len(batch))):
+            if usage is not None:
+                usage.extend(share)
+        await asyncio.gather(*(
+            self._resolve(item, future, usage, source_url, text)
+            for (item, future, usage, source_url), text in zip(batch, results)
+        ))
+
+    async def _resolve(self, item, future, usage, source_url, text):
+        if text is None:
+            metrics.inc('caption_fallbacks')
+            try:
+                with metrics.timer('caption', model=CAPTION_MODEL):
+                    text = await asyncio.to_thread(paraphrase_caption, *item, usage, source_url)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+        if not future.done():
+            future.set_result(text)
+
+
+_engine = None
+
+def get_caption_engine():
+    global _engine
+    if _engine is None:
+        _engine = CaptionEngine()
+    return _engine
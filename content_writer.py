@@ -1,9 +1,13 @@
-import google.generativeai as genai
-import os
-import markdown2
+import json
+import logging
 import re
+from gemini_client import get_gemini_client
+from result_cache import get_cache
 
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+POST_MODEL = 'gemini-2.5-pro'
+CAPTION_MODEL = 'gemini-2.5-flash'
+# Tăng khi sửa prompt / cách xử lý output để cache cũ không còn được dùng
+PROMPT_VERSION = 1
 
 def clean_markdown(md):
     lines = md.splitlines()
@@ -31,33 +35,101 @@ def extract_h1_and_remove(md):
 def extract_h2_list(md):
     return re.findall(r'^\s*##\s*(.+)$', md, re.MULTILINE)
 
-def paraphrase_caption(h2_text, team_home, team_away):
+def _clean_caption(text):
+    text = re.sub(r"^[-\d. ]+", "", (text or "").strip()).strip()
+    return text.split('\n')[0].strip()
+
+def paraphrase_caption(h2_text, team_home, team_away, usage=None, source_url=""):
     prompt = (
         f'Bạn là AI chuyên gia bóng đá, viết caption ảnh cho bài nhận định trận "{team_home}" vs "{team_away}". '
         f'Hãy viết lại tiêu đề "{h2_text}" thành một câu mô tả ngắn khoản 10 từ đến 15 từ (caption), '
         f'làm rõ bối cảnh trận {team_home} đối đầu {team_away}, không lặp lại tiêu đề gốc, không liệt kê, chỉ trả về một câu duy nhất bằng tiếng Việt, không giải thích gì thêm.'
     )
+    cache = get_cache()
+    parts = {'h2': h2_text, 'home': team_home, 'away': team_away, 'model': CAPTION_MODEL, 'version': PROMPT_VERSION}
+    if cache:
+        hit = cache.get('caption', parts)
+        if hit:
+            return hit
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content([prompt])
-        text = response.text.strip()
-        text = re.sub(r"^[-\d. ]+", "", text).strip()
-        text = text.split('\n')[0].strip()
+        response = get_gemini_client().generate(CAPTION_MODEL, prompt, usage=usage, output_tokens=128)
+        text = _clean_caption(response.text)
+        if cache and text:
+            cache.set('caption', parts, text, source_url)
         return text
-    except Exception:
+    except Exception as e:
+        logging.warning("paraphrase_caption lỗi, dùng nguyên H2 làm caption: %s", e)
         return h2_text
 
-def ensure_internal_link(content, anchor_text, anchor_url):
-    if f'<a href="{anchor_url}"><strong>{anchor_text}</strong></a>' in content \
-        or f'<a href="{anchor_url}"><b>{anchor_text}</b></a>' in content:
-        return content
-    def replacer(match):
-        return f'<a href="{anchor_url}"><strong>{anchor_text}</strong></a>'
-    pattern = rf'(?<![">])({re.escape(anchor_text)})(?!<\/a>)'
-    return re.sub(pattern, replacer, content, count=1)
-
-def generate_post(source_url, anchor_text, anchor_url):
-    prompt = f"""Bạn là một chuyên gia viết nội dung nhận định và soi kèo dự đoán kết quả bóng đá chuẩn SEO. 
+CAPTION_BATCH_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER"},
+            "caption": {"type": "STRING"},
+        },
+        "required": ["id", "caption"],
+    },
+}
+
+def paraphrase_captions(items, usage=None, source_urls=None):
+    """
+    Viết caption cho nhiều H2 (của nhiều bài) trong một lần gọi Gemini (JSON theo CAPTION_BATCH_SCHEMA).
+    items: [(h2_text, team_home, team_away)]. Trả về list caption cùng thứ tự, None cho mục không lấy được
+    (người gọi tự gọi paraphrase_caption riêng cho mục đó). Dùng chung cache 'caption' với paraphrase_caption;
+    source_urls (cùng thứ tự items) là url nguồn ghi kèm entry cache để /cache list|purge <url> thấy caption.
+    """
+    source_urls = source_urls or [""] * len(items)
+    cache = get_cache()
+    results = [None] * len(items)
+    todo = []
+    for i, (h2_text, team_home, team_away) in enumerate(items):
+        parts = {'h2': h2_text, 'home': team_home, 'away': team_away, 'model': CAPTION_MODEL, 'version': PROMPT_VERSION}
+        hit = cache.get('caption', parts) if cache else None
+        if hit:
+            results[i] = hit
+        else:
+            todo.append((i, parts))
+    if not todo:
+        return results
+    listing = "\n".join(
+        f'{n}. Trận "{parts["home"]}" vs "{parts["away"]}": "{parts["h2"]}"' for n, (_, parts) in enumerate(todo, 1)
+    )
+    prompt = (
+        'Bạn là AI chuyên gia bóng đá, viết caption ảnh cho các bài nhận định trận đấu. '
+        'Với mỗi tiêu đề đánh số dưới đây, hãy viết lại thành một câu mô tả ngắn khoảng 10 từ đến 15 từ (caption), '
+        'làm rõ bối cảnh trận đội nhà đối đầu đội khách của chính tiêu đề đó, không lặp lại tiêu đề gốc, không liệt kê, '
+        'bằng tiếng Việt.\n\n'
+        f'{listing}\n\n'
+        'Trả về JSON là danh sách {"id": số thứ tự, "caption": câu caption}, mỗi tiêu đề đúng một phần tử.'
+    )
+    try:
+        response = get_gemini_client().generate(
+            CAPTION_MODEL, prompt,
+            generation_config={"response_mime_type": "application/json", "response_schema": CAPTION_BATCH_SCHEMA},
+            usage=usage, output_tokens=48 * len(todo),
+        )
+        data = json.loads(response.text)
+    except Exception as e:
+        logging.warning("paraphrase_captions lỗi (%d caption): %s", len(todo), e)
+        return results
+    for entry in data if isinstance(data, list) else []:
+        try:
+            n = int(entry.get('id'))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        text = _clean_caption(entry.get('caption'))
+        if not text or not 1 <= n <= len(todo) or results[todo[n - 1][0]] is not None:
+            continue
+        i, parts = todo[n - 1]
+        results[i] = text
+        if cache:
+            cache.set('caption', parts, text, source_urls[i])
+    return results
+
+def _post_requirements(source_url, anchor_text, anchor_url):
+    return f"""Bạn là một chuyên gia viết nội dung nhận định và soi kèo dự đoán kết quả bóng đá chuẩn SEO. 
 Viết một bài blog dài khoảng 700 đến 800 từ chuẩn SEO, hãy vào url {source_url} để lấy dữ liệu từ url này để viết bài, yêu cầu lấy đúng toàn bộ thông tin về phân tích kèo trong url để viết.
 
 ⚠️ Trong bài viết, bạn phải **chèn một liên kết nội bộ (internal link) với dạng HTML, với anchor text: "{anchor_text}" và url: {anchor_url}** vào một vị trí phù hợp trong thân bài (không ở đầu hoặc cuối bài, không lặp lại). 
@@ -77,19 +149,121 @@ Yêu cầu:
 
 Lưu ý: Bài viết bằng tiếng Việt, bắt đầu bài viết ngay, không có lời nói đầu hoặc kết bài.
 """
+
+def markdown_to_html(raw_md):
+    """
+    Làm sạch markdown Gemini trả về, tách H1 + danh sách H2 và chuyển phần còn lại sang HTML.
+    HTML trả về chưa chèn internal link / ảnh: việc đó do html_post.postprocess_html làm một lượt lúc đăng bài.
+    """
+    cleaned_md = clean_markdown(raw_md)
+    h1_title, markdown_no_h1 = extract_h1_and_remove(cleaned_md)
+    h2s_list = extract_h2_list(markdown_no_h1)
+    import markdown2
+    html = markdown2.markdown(markdown_no_h1, extras=["tables", "fenced-code-blocks", "strike", "cuddled-lists"])
+    return h1_title, h2s_list, html
+
+def _generate(model_name, prompt, usage=None, **kwargs):
+    """
+    Gọi Gemini, trả về (response, model đã trả lời thật: model_name hoặc model dự phòng)
+    """
+    calls = []
+    response = get_gemini_client().generate(model_name, prompt, usage=calls, **kwargs)
+    if usage is not None:
+        usage.extend(calls)
+    return response, calls[-1]['model']
+
+def _cache_parts(source_url, anchor_text, anchor_url):
+    return {
+        'source_url': source_url,
+        'anchor_text': anchor_text,
+        'anchor_url': anchor_url,
+        'model': POST_MODEL,
+        'version': PROMPT_VERSION,
+    }
+
+def generate_post(source_url, anchor_text, anchor_url, usage=None):
+    cache = get_cache()
+    parts = _cache_parts(source_url, anchor_text, anchor_url)
+    if cache:
+        hit = cache.get('post', parts)
+        if hit:
+            return tuple(hit)
+    prompt = _post_requirements(source_url, anchor_text, anchor_url)
     try:
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        response = model.generate_content([prompt])
+        response, model = _generate(POST_MODEL, prompt, usage, output_tokens=4096)
         raw_md = response.text.strip()
-        cleaned_md = clean_markdown(raw_md)
-        h1_title, markdown_no_h1 = extract_h1_and_remove(cleaned_md)
-        h2s_list = extract_h2_list(markdown_no_h1)
-        html = markdown2.markdown(markdown_no_h1, extras=["tables", "fenced-code-blocks", "strike", "cuddled-lists"])
-        html = re.sub(r'<p>(\s*<h[1-6][^>]*>.*?</h[1-6]>)\s*</p>', r'\1', html, flags=re.DOTALL)
-        html = ensure_internal_link(html, anchor_text, anchor_url)
+        h1_title, h2s_list, html = markdown_to_html(raw_md)
+        # Bài do model dự phòng viết không lưu cache: lần chạy sau vẫn thử model chính
+        if cache and h1_title and model == POST_MODEL:
+            cache.set('post', parts, [h1_title, h2s_list, html], source_url)
         return h1_title, h2s_list, html
     except Exception as e:
-        import traceback
-        print("[ERROR] generate_post:", e)
-        print(traceback.format_exc())
+        logging.exception("generate_post lỗi")
         return "", [], f"Lỗi khi gọi Gemini: {e}"
+
+BUNDLE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "team_home": {"type": "STRING"},
+        "team_away": {"type": "STRING"},
+        "h1": {"type": "STRING"},
+        "h2s": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "markdown": {"type": "STRING"},
+        "caption_first_h2": {"type": "STRING"},
+        "caption_last_h2": {"type": "STRING"},
+    },
+    "required": ["team_home", "team_away", "h1", "h2s", "markdown", "caption_first_h2", "caption_last_h2"],
+}
+
+def generate_post_bundle(source_url, anchor_text, anchor_url, usage=None):
+    """
+    Một lần gọi Gemini (JSON theo BUNDLE_SCHEMA) trả về tên hai đội, bài viết và caption cho H2 đầu/cuối.
+    Trả về dict {team_home, team_away, h1, h2s, html, caption_first, caption_last},
+    hoặc None nếu lỗi / không parse được (khi đó dùng lại luồng nhiều lần gọi).
+    """
+    cache = get_cache()
+    parts = _cache_parts(source_url, anchor_text, anchor_url)
+    if cache:
+        hit = cache.get('bundle', parts)
+        if hit:
+            return hit
+    prompt = _post_requirements(source_url, anchor_text, anchor_url) + """
+Trả về JSON đúng schema, các trường:
+- team_home, team_away: tên tiếng Anh chuẩn của đội nhà và đội khách (chỉ in hoa chữ cái đầu, không thêm mô tả).
+- h1: tiêu đề H1 của bài (không có dấu #).
+- h2s: danh sách tiêu đề H2 theo đúng thứ tự trong bài (không có dấu ##).
+- markdown: toàn bộ thân bài bằng markdown, KHÔNG gồm dòng H1.
+- caption_first_h2, caption_last_h2: viết lại tiêu đề H2 đầu tiên / cuối cùng thành một câu caption ảnh khoảng 10 đến 15 từ,
+  làm rõ bối cảnh trận đội nhà đối đầu đội khách, không lặp lại tiêu đề gốc, bằng tiếng Việt.
+"""
+    try:
+        response, model = _generate(
+            POST_MODEL, prompt, usage,
+            generation_config={"response_mime_type": "application/json", "response_schema": BUNDLE_SCHEMA},
+            output_tokens=6144,
+        )
+        data = json.loads(response.text)
+        team_home = (data.get('team_home') or "").strip()
+        team_away = (data.get('team_away') or "").strip()
+        raw_md = (data.get('markdown') or "").strip()
+        h1_title = (data.get('h1') or "").lstrip("# ").strip()
+        if not (team_home and team_away and h1_title and raw_md):
+            raise ValueError("JSON thiếu trường bắt buộc")
+        md_h1, h2s_list, html = markdown_to_html(raw_md)
+        if not h2s_list:
+            h2s_list = [h.lstrip("# ").strip() for h in data.get('h2s') or [] if h.strip()]
+        bundle = {
+            'team_home': team_home,
+            'team_away': team_away,
+            'h1': h1_title or md_h1,
+            'h2s': h2s_list,
+            'html': html,
+            'caption_first': (data.get('caption_first_h2') or "").strip(),
+            'caption_last': (data.get('caption_last_h2') or "").strip(),
+        }
+        if cache and model == POST_MODEL:
+            cache.set('bundle', parts, bundle, source_url)
+        return bundle
+    except Exception as e:
+        logging.warning("generate_post_bundle lỗi, quay về luồng nhiều lần gọi: %s", e)
+        return None
@@ -0,0 +1,339 @@
+"""
+Chạy thử toàn bộ pipeline trên một file Excel mà không gọi Gemini / WordPress / Sinbyte / Telegram thật:
+Gemini giả (FakeBackend trả markdown / JSON theo mẫu, có độ trễ), server WP REST + Sinbyte giả chạy local,
+tiến độ in ra console. Chạy nhiều mức MAX_WORKERS để đo số dòng/phút và thời gian từng stage.
+
+    python dry_run.py file.xlsx
+    python dry_run.py --sample 200 --workers 1 2 4 8 --quiet
+"""
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+TEAMS = [
+    'Arsenal', 'Chelsea', 'Liverpool', 'Manchester United', 'Manchester City', 'Tottenham',
+    'Real Madrid', 'Barcelona', 'Atletico Madrid', 'Bayern Munich', 'Borussia Dortmund',
+    'Juventus', 'Inter Milan', 'AC Milan', 'Napoli', 'PSG',
+]
+
+
+# ===== Gemini giả =====
+def _teams_for(text):
+    digest = hashlib.md5(text.encode('utf-8')).digest()
+    home = TEAMS[digest[0] % len(TEAMS)]
+    away = TEAMS[(digest[0] + 1 + digest[1] % (len(TEAMS) - 1)) % len(TEAMS)]
+    return home, away
+
+def _fake_markdown(prompt):
+    source = re.search(r"vào url (\S+)", prompt)
+    home, away = _teams_for(source.group(1) if source else prompt)
+    link = re.search(r'anchor text: "(.*?)" và url: (\S+?)\*\*', prompt)
+    anchor = f'<a href="{link.group(2)}"><strong>{link.group(1)}</strong></a>' if link else ""
+    filler = (
+        f"{home} bước vào trận đấu với tâm lý hưng phấn sau chuỗi trận ổn định, trong khi {away} "
+        "vẫn đang tìm lại sự cân bằng giữa hàng công và hàng thủ. Các chỉ số kiểm soát bóng, "
+        "số cú sút trúng đích và hiệu số bàn thắng cho thấy thế trận sẽ khá giằng co. "
+    ) * 3
+    return "\n".join([
+        f"# Nhận Định Bóng Đá: {home} vs {away} ngày 25/12/2025",
+        "",
+        filler,
+        "",
+        f"## Phong độ gần đây của {home} và {away}",
+        "",
+        filler,
+        "",
+        "| Đội | Thắng | Hoà | Thua |",
+        "| --- | --- | --- | --- |",
+        f"| {home} | 3 | 1 | 1 |",
+        f"| {away} | 2 | 2 | 1 |",
+        "",
+        f"## Phân tích kèo {home} vs {away}",
+        "",
+        f"{filler} Xem thêm {anchor} để cập nhật tỷ lệ mới nhất.",
+        "",
+        "### Kèo châu Á",
+        "",
+        f"**{home}** chấp nửa trái, {filler}",
+        "",
+        "## Dự đoán tỉ số",
+        "",
+        f"{filler} Dự đoán: {home} 2-1 {away}.",
+    ])
+
+def fake_responder(model_name, prompt, generation_config):
+    """
+    Trả lời giả theo loại prompt của content_writer / gemini_extract_team
+    """
+    from content_writer import BUNDLE_SCHEMA, CAPTION_BATCH_SCHEMA
+    schema = (generation_config or {}).get('response_schema')
+    if schema is BUNDLE_SCHEMA:
+        md = _fake_markdown(prompt)
+        h1 = md.splitlines()[0][2:]
+        body = "\n".join(md.splitlines()[1:])
+        h2s = re.findall(r'^##\s+(.+)$', body, re.MULTILINE)
+        home, away = h1.split(": ", 1)[1].split(" ngày")[0].split(" vs ")
+        return json.dumps({
+            'team_home': home, 'team_away': away, 'h1': h1, 'h2s': h2s, 'markdown': body,
+            'caption_first_h2': f"Khoảnh khắc {home} và {away} bước vào trận cầu đáng chú ý",
+            'caption_last_h2': f"Dự đoán kết quả màn so tài giữa {home} và {away}",
+        }, ensure_ascii=False)
+    if schema is CAPTION_BATCH_SCHEMA:
+        items = re.findall(r'^(\d+)\. Trận "(.*?)" vs "(.*?)"', prompt, re.MULTILINE)
+        return json.dumps([
+            {'id': int(n), 'caption': f"Toàn cảnh màn đối đầu giữa {home} và {away} trên sân cỏ"}
+            for n, home, away in items
+        ], ensure_ascii=False)
+    if "tên hai đội" in prompt:
+        source = re.search(r"vào url (\S+)", prompt)
+        return "\n".join(_teams_for(source.group(1) if source else prompt))
+    if "caption" in prompt:
+        teams = re.search(r'trận "(.*?)" vs "(.*?)"', prompt)
+        return f"Toàn cảnh màn đối đầu giữa {teams.group(1)} và {teams.group(2)} trên sân cỏ" if teams else "Caption"
+    return _fake_markdown(prompt)
+
+
+# ===== WordPress + Sinbyte giả =====
+def _background_jpeg(size=(800, 450)):
+    from PIL import Image
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    POST <site>/wp-json/wp/v2/media|posts, GET <site>/wp-json/wp/v2/media/<id>, POST /sinbyte, GET /bg.jpg.
+    HTTP/1.1 keep-alive; đếm số kết nối TCP (server.connections) và số request theo route (server.requests)
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _count(self, route):
+        with self.server.lock:
+            self.server.requests[route] = self.server.requests.get(route, 0) + 1
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/bg.jpg':
+            self._reply(200, self.server.background, 'image/jpeg')
+            return
+        site, _, route = self.path.partition('/wp-json/wp/v2/')
+        if route.startswith('media/') and route[len('media/'):].isdigit():
+            self._count('GET media')
+            item_id = route[len('media/'):]
+            self._reply(200, {'id': int(item_id), 'source_url': f"http://{self.headers.get('Host')}{site}/wp-content/uploads/{item_id}.jpg"})
+        else:
+            self._reply(404, {'code': 'rest_no_route'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        server = self.server
+        if self.path == '/sinbyte':
+            server.index_requests += 1
+            self._reply(200, {'status': 'ok'})
+            return
+        site, _, route = self.path.partition('/wp-json/wp/v2/')
+        if route not in ('media', 'posts'):
+            self._reply(404, {'code': 'rest_no_route'})
+            return
+        self._count(f"POST {route}")
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.next_id += 1
+            item_id = server.next_id
+        base = f"http://{self.headers.get('Host')}{site}"
+        if route == 'media':
+            self._reply(201, {'id': item_id, 'source_url': f"{base}/wp-content/uploads/{item_id}.jpg"})
+        else:
+            self._reply(201, {'id': item_id, 'link': f"{base}/?p={item_id}"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency=0.0):
+    """
+    Chạy server giả ở 127.0.0.1 (cổng ngẫu nhiên) trong thread nền, trả về (server, base_url)
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.next_id = 0
+    server.index_requests = 0
+    server.connections = 0
+    server.requests = {}
+    server.background = _background_jpeg()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ===== Telegram giả =====
+class _Message:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class ConsoleBot:
+    """
+    Thay telegram.Bot cho ProgressNotifier: in tin nhắn ra console (bỏ thẻ HTML)
+    """
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self._next_id = 0
+
+    @staticmethod
+    def _plain(text):
+        return html.unescape(re.sub(r"<[^>]+>", "", text))
+
+    async def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        self._next_id += 1
+        if not self.quiet:
+            print(self._plain(text), flush=True)
+        return _Message(self._next_id)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, parse_mode=None, **kwargs):
+        if not self.quiet:
+            print(self._plain(text), flush=True)
+        return True
+
+
+# ===== Chạy thử / benchmark =====
+def write_sample_sheet(path, rows, sites=5):
+    from openpyxl import Workbook
+    from excel_reader import ACCOUNTS_SHEET, KEYWORDS_SHEET, ACCOUNT_COLUMNS, KEYWORD_COLUMNS
+    wb = Workbook()
+    accounts = wb.active
+    accounts.title = ACCOUNTS_SHEET
+    accounts.append(list(ACCOUNT_COLUMNS))
+    for i in range(sites):
+        accounts.append([f"https://site{i}.example", "admin", "app-password", "https://example.com/bg.jpg"])
+    keywords = wb.create_sheet(KEYWORDS_SHEET)
+    keywords.append(list(KEYWORD_COLUMNS))
+    for i in range(rows):
+        keywords.append([
+            f"https://source.example/nhan-dinh-tran-{i}", f"site{i % sites}.example", 1,
+            "kèo nhà cái", f"https://site{i % sites}.example/keo-nha-cai",
+        ])
+    wb.save(path)
+
+
+def configure_env(base_url, work_dir):
+    """
+    Trỏ mọi thứ có trạng thái về work_dir và server giả. Phải gọi trước khi import bot
+    """
+    os.environ.update({
+        'RESULT_CACHE_PATH': '',
+        'JOB_JOURNAL_PATH': os.path.join(work_dir, 'journal.sqlite3'),
+        'INDEX_QUEUE_PATH': os.path.join(work_dir, 'index_queue.sqlite3'),
+        'JOB_QUEUE_PATH': os.path.join(work_dir, 'jobs.sqlite3'),
+        'JOBS_DIR': os.path.join(work_dir, 'jobs'),
+        'SINBYTE_API_KEY': 'dry-run',
+        'SINBYTE_API_URL': f"{base_url}/sinbyte",
+    })
+    os.environ.pop('BG_CACHE_DIR', None)
+    os.environ.pop('METRICS_PROM_FILE', None)
+
+
+async def run_benchmark(file_path, base_url, work_dir, worker_counts, quiet):
+    import bot
+    import job_journal
+    from excel_reader import normalize_website
+    from metrics import metrics
+
+    def map_account(acc):
+        return acc._replace(website=f"{base_url}/{normalize_website(acc.website)}", background=f"{base_url}/bg.jpg")
+
+    results = []
+    for workers in worker_counts:
+        # Journal mới cho mỗi lượt, nếu không các dòng đã đăng ở lượt trước sẽ bị bỏ qua
+        job_journal._journal = job_journal.JobJournal(os.path.join(work_dir, f"journal-{workers}.sqlite3"))
+        bot.MAX_WORKERS = workers
+        metrics.reset()
+        started = time.perf_counter()
+        await bot.process_excel(file_path, ConsoleBot(quiet), chat_id=0, map_account=map_account)
+        elapsed = time.perf_counter() - started
+        stages = metrics.stage_summary()
+        published = sum(count - errors for stage, count, _, _, _, errors in stages if stage == 'publish')
+        results.append((workers, published, elapsed, stages))
+        print(f"\n== MAX_WORKERS={workers}: {published} bài trong {elapsed:.1f}s "
+              f"({published / elapsed * 60:.1f} dòng/phút)")
+        for stage, count, avg, p50, p95, errors in stages:
+            print(f"   {stage:<9} {count:>5} lần  tb {avg:6.2f}s  p50≤{p50:<6g} p95≤{p95:<6g} lỗi {errors}")
+    print("\nMAX_WORKERS | dòng/phút")
+    for workers, published, elapsed, _ in results:
+        print(f"{workers:>11} | {published / elapsed * 60:.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy thử pipeline offline với Gemini / WordPress / Sinbyte / Telegram giả")
+    parser.add_argument("file", nargs="?", help="file Excel (bỏ trống nếu dùng --sample)")
+    parser.add_argument("--sample", type=int, metavar="N", help="tự tạo file Excel mẫu N dòng")
+    parser.add_argument("--sites", type=int, default=5, help="số website trong file mẫu")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4], help="các mức MAX_WORKERS cần đo")
+    parser.add_argument("--pro-latency", type=float, default=3.0, help="giây mỗi lần gọi gemini-2.5-pro giả")
+    parser.add_argument("--flash-latency", type=float, default=0.8, help="giây mỗi lần gọi gemini-2.5-flash giả")
+    parser.add_argument("--wp-latency", type=float, default=0.2, help="giây mỗi request WordPress giả")
+    parser.add_argument("--quiet", action="store_true", help="không in tiến độ, chỉ in kết quả đo")
+    args = parser.parse_args()
+    if not args.file and not args.sample:
+        parser.error("cần file Excel hoặc --sample N")
+
+    work_dir = tempfile.mkdtemp(prefix="dry_run-")
+    server, base_url = start_stub_server(args.wp_latency)
+    configure_env(base_url, work_dir)
+
+    from gemini_client import FakeBackend, set_backend
+    set_backend(FakeBackend(fake_responder, latency={
+        'gemini-2.5-pro': args.pro_latency,
+        'gemini-2.5-flash': args.flash_latency,
+    }))
+    file_path = args.file
+    if args.sample:
+        file_path = os.path.join(work_dir, f"sample-{args.sample}.xlsx")
+        write_sample_sheet(file_path, args.sample, args.sites)
+    try:
+        results = asyncio.run(run_benchmark(file_path, base_url, work_dir, args.workers, args.quiet))
+    finally:
+        server.shutdown()
+        import render_pool
+        if render_pool._pool is not None:
+            render_pool._pool.shutdown()
+    print(f"\nSinbyte giả nhận {server.index_requests} request. Dữ liệu chạy thử: {work_dir}")
+    # File mẫu: dòng nào không đăng được (lỗi / treo) thì exit 1, dùng được làm kiểm tra hồi quy
+    missing = [workers for workers, published, _, _ in results if args.sample and published < args.sample]
+    if missing:
+        print(f"FAIL: chưa đăng đủ {args.sample} dòng với MAX_WORKERS={missing}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
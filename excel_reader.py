@@ -1,6 +1,137 @@
-import pandas as pd
+import unicodedata
+from typing import NamedTuple, Optional
 
-def read_excel(file_path):
-    accounts = pd.read_excel(file_path, sheet_name='tai_khoan')
-    keywords = pd.read_excel(file_path, sheet_name='key_word')
-    return accounts, keywords
+ACCOUNTS_SHEET = 'tai_khoan'
+KEYWORDS_SHEET = 'key_word'
+
+# Tên cột trong file Excel -> tên field
+ACCOUNT_COLUMNS = {
+    'website': 'website',
+    'tài khoản': 'username',
+    'mật khẩu': 'password',
+    'background ảnh': 'background',
+}
+KEYWORD_COLUMNS = {
+    'url bài viết nguồn': 'src_url',
+    'website cần đăng': 'website',
+    'id chuyên mục cần đăng': 'cat_id',
+    'anchor text': 'anchor_text',
+    'url anchor text': 'anchor_url',
+}
+
+
+class ExcelFormatError(ValueError):
+    pass
+
+
+class Account(NamedTuple):
+    website: str
+    username: str
+    password: str
+    background: str
+
+
+class KeywordRow(NamedTuple):
+    row_number: int  # số dòng trong Excel (dòng 1 là header)
+    src_url: str
+    website: str
+    cat_id: int
+    anchor_text: str
+    anchor_url: str
+    error: Optional[str] = None  # lỗi dữ liệu của dòng, None nếu hợp lệ
+
+
+def _norm_header(value):
+    return unicodedata.normalize('NFC', str(value or '')).strip().lower()
+
+def normalize_website(url):
+    """
+    Chuẩn hoá url website để tra account: bỏ http(s)://, www., dấu / cuối, viết thường
+    """
+    url = str(url or '').strip().lower()
+    for prefix in ('https://', 'http://'):
+        if url.startswith(prefix):
+            url = url[len(prefix):]
+    if url.startswith('www.'):
+        url = url[4:]
+    return url.rstrip('/')
+
+def _iter_sheet(file_path, sheet_name, columns):
+    """
+    Đọc sheet ở chế độ read-only, kiểm tra header, yield (số dòng, {field: giá trị}) cho từng dòng không rỗng
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            raise ExcelFormatError(f"Không có sheet '{sheet_name}' trong file Excel")
+        rows = wb[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise ExcelFormatError(f"Sheet '{sheet_name}' trống")
+        positions = {_norm_header(h): i for i, h in enumerate(header) if _norm_header(h)}
+        missing = [col for col in columns if col not in positions]
+        if missing:
+            raise ExcelFormatError(f"Sheet '{sheet_name}' dòng 1 thiếu cột: {', '.join(missing)}")
+        for row_number, values in enumerate(rows, start=2):
+            if not values or all(v is None or str(v).strip() == '' for v in values):
+                continue
+            record = {}
+            for col, field in columns.items():
+                i = positions[col]
+                value = values[i] if i < len(values) else None
+                record[field] = value.strip() if isinstance(value, str) else value
+            yield row_number, record
+    finally:
+        wb.close()
+
+def read_accounts(file_path):
+    """
+    Đọc sheet tai_khoan, trả về {website đã chuẩn hoá: Account} (trùng website thì lấy dòng đầu tiên)
+    """
+    accounts = {}
+    for row_number, record in _iter_sheet(file_path, ACCOUNTS_SHEET, ACCOUNT_COLUMNS):
+        if not record['website']:
+            raise ExcelFormatError(f"Sheet '{ACCOUNTS_SHEET}' dòng {row_number}: thiếu website")
+        account = Account(**{k: str(v) if v is not None else '' for k, v in record.items()})
+        accounts.setdefault(normalize_website(account.website), account)
+    return accounts
+
+def count_keyword_rows(file_path):
+    """
+    Số dòng dữ liệu ước lượng của sheet key_word (theo kích thước sheet, không đọc hết dữ liệu).
+    None nếu file không ghi kích thước.
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if KEYWORDS_SHEET not in wb.sheetnames:
+            raise ExcelFormatError(f"Không có sheet '{KEYWORDS_SHEET}' trong file Excel")
+        max_row = wb[KEYWORDS_SHEET].max_row
+        return max(0, max_row - 1) if max_row else None
+    finally:
+        wb.close()
+
+def iter_keywords(file_path):
+    """
+    Đọc dần sheet key_word, yield KeywordRow cho từng dòng.
+    Dòng thiếu dữ liệu / sai kiểu vẫn được yield, kèm error để bên xử lý báo lại và bỏ qua.
+    """
+    for row_number, record in _iter_sheet(file_path, KEYWORDS_SHEET, KEYWORD_COLUMNS):
+        missing = [col for col, field in KEYWORD_COLUMNS.items() if record[field] in (None, '')]
+        error = f"Sheet '{KEYWORDS_SHEET}' dòng {row_number}: thiếu {', '.join(missing)}" if missing else None
+        cat_id = record['cat_id']
+        if not error:
+            try:
+                cat_id = int(float(cat_id))
+            except (TypeError, ValueError):
+                error = f"Sheet '{KEYWORDS_SHEET}' dòng {row_number}: id chuyên mục không phải số ({cat_id})"
+        yield KeywordRow(
+            row_number=row_number,
+            src_url=str(record['src_url'] or ''),
+            website=str(record['website'] or ''),
+            cat_id=cat_id if not error else 0,
+            anchor_text=str(record['anchor_text'] or ''),
+            anchor_url=str(record['anchor_url'] or ''),
+            error=error,
+        )
@@ -0,0 +1,323 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from metrics import metrics
+
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '180'))
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', '5'))
+GEMINI_BACKOFF_BASE = float(os.getenv('GEMINI_BACKOFF_BASE', '2'))
+GEMINI_BACKOFF_MAX = float(os.getenv('GEMINI_BACKOFF_MAX', '60'))
+# Model chính phải chờ quota lâu hơn số giây này thì chuyển sang model dự phòng (nếu model đó còn chỗ)
+GEMINI_FALLBACK_WAIT = float(os.getenv('GEMINI_FALLBACK_WAIT', '10'))
+
+# Giới hạn mặc định (RPM, TPM) theo model, ghi đè bằng GEMINI_LIMITS="model:rpm:tpm,model:rpm:tpm"
+DEFAULT_LIMITS = {
+    'gemini-2.5-pro': (150, 2_000_000),
+    'gemini-2.5-flash': (1000, 1_000_000),
+}
+FALLBACK_MODELS = {
+    'gemini-2.5-pro': 'gemini-2.5-flash',
+}
+# Mã lỗi HTTP đáng thử lại: quota / quá tải / timeout phía server
+RETRYABLE_CODES = {429, 500, 503, 504}
+
+
+def _parse_limits(spec):
+    limits = dict(DEFAULT_LIMITS)
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        model, rpm, tpm = item.strip().rsplit(":", 2)
+        limits[model] = (int(rpm), int(tpm))
+    return limits
+
+GEMINI_LIMITS = _parse_limits(os.getenv('GEMINI_LIMITS'))
+
+
+class GeminiError(Exception):
+    """
+    Gọi Gemini thất bại sau khi đã thử lại / chuyển model dự phòng
+    """
+
+
+def record_usage(usage, model_name, response, started):
+    """
+    Ghi lại token + thời gian của một lần gọi Gemini vào list usage (nếu có)
+    """
+    if usage is None:
+        return
+    meta = getattr(response, 'usage_metadata', None)
+    usage.append({
+        'model': model_name,
+        'prompt_tokens': getattr(meta, 'prompt_token_count', 0) or 0,
+        'output_tokens': getattr(meta, 'candidates_token_count', 0) or 0,
+        'total_tokens': getattr(meta, 'total_token_count', 0) or 0,
+        'seconds': time.perf_counter() - started,
+    })
+
+def summarize_usage(usage):
+    calls = len(usage)
+    prompt_tokens = sum(u['prompt_tokens'] for u in usage)
+    output_tokens = sum(u['output_tokens'] for u in usage)
+    seconds = sum(u['seconds'] for u in usage)
+    return f"{calls} lần gọi Gemini, {prompt_tokens} token vào / {output_tokens} token ra, {seconds:.1f}s"
+
+
+def _status_code(exc):
+    code = getattr(exc, 'code', None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(exc):
+    if isinstance(exc, TimeoutError):
+        return True
+    code = _status_code(exc)
+    if code in RETRYABLE_CODES:
+        return True
+    # google.api_core: DeadlineExceeded / ServiceUnavailable / ResourceExhausted...
+    return type(exc).__name__ in ('DeadlineExceeded', 'ServiceUnavailable', 'ResourceExhausted', 'RetryError')
+
+
+class ModelQuota:
+    """
+    Cửa sổ trượt 60s cho một model: số request và số token đã dùng.
+    reserve() chờ tới khi còn chỗ rồi giữ chỗ; commit() sửa lại theo số token thật.
+    """
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._events = deque()  # [thời điểm, token]
+        self._tokens = 0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.WINDOW:
+            self._tokens -= self._events.popleft()[1]
+
+    def wait_time(self, tokens):
+        """
+        Số giây phải chờ trước khi gửi được request ~tokens token
+        """
+        with self._lock:
+            return self._wait_locked(time.monotonic(), tokens)
+
+    def _wait_locked(self, now, tokens):
+        self._expire(now)
+        wait = max(0.0, self._blocked_until - now)
+        if len(self._events) >= self.rpm:
+            wait = max(wait, self._events[0][0] + self.WINDOW - now)
+        if self._events and self._tokens + tokens > self.tpm:
+            # Chờ tới khi đủ token cũ hết hạn khỏi cửa sổ
+            freed = 0
+            for ts, n in self._events:
+                freed += n
+                if self._tokens - freed + tokens <= self.tpm:
+                    wait = max(wait, ts + self.WINDOW - now)
+                    break
+            else:
+                wait = max(wait, self._events[-1][0] + self.WINDOW - now)
+        return wait
+
+    def reserve(self, tokens):
+        """
+        Chờ (blocking) tới khi còn quota rồi giữ chỗ. Trả về entry để commit() sau
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_locked(now, tokens)
+                if wait <= 0:
+                    entry = [now, tokens]
+                    self._events.append(entry)
+                    self._tokens += tokens
+                    return entry
+            time.sleep(min(wait, 5.0))
+
+    def commit(self, entry, tokens):
+        with self._lock:
+            if entry in self._events:
+                self._tokens += tokens - entry[1]
+            entry[1] = tokens
+
+    def block(self, seconds):
+        """
+        Server báo hết quota (429): không gửi thêm cho model này trong seconds giây
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class GenaiBackend:
+    """
+    Backend thật: google.generativeai, configure một lần ở lần gọi đầu
+    """
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._genai = None
+        self._lock = threading.Lock()
+
+    def _module(self):
+        with self._lock:
+            if self._genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key or os.getenv('GEMINI_API_KEY'))
+                self._genai = genai
+            return self._genai
+
+    def warm_up(self):
+        self._module()
+
+    def generate(self, model_name, prompt, generation_config=None, timeout=GEMINI_TIMEOUT):
+        genai = self._module()
+        model = genai.GenerativeModel(model_name, generation_config=generation_config)
+        return model.generate_content([prompt], request_options={'timeout': timeout})
+
+
+class _FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens=0, output_tokens=0):
+        self.text = text
+        self.usage_metadata = _FakeUsage(prompt_tokens, output_tokens)
+
+
+class FakeBackend:
+    """
+    Backend giả để chạy thử / đo đạc không cần API key.
+    responder(model_name, prompt, generation_config) trả về text; latency là số giây (hoặc (min, max)) mỗi lần gọi,
+    hoặc dict {model: latency} cho từng model;
+    errors là list exception lần lượt ném ra trước khi trả lời thật (giả lập 429/503).
+    """
+
+    def __init__(self, responder=None, latency=0.0, errors=()):
+        self.responder = responder or (lambda model_name, prompt, config: "OK")
+        self.latency = latency
+        self.errors = list(errors)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def generate(self, model_name, prompt, generation_config=None, timeout=GEMINI_TIMEOUT):
+        with self._lock:
+            self.calls.append(model_name)
+            error = self.errors.pop(0) if self.errors else None
+        latency = self.latency.get(model_name, 0.0) if isinstance(self.latency, dict) else self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+        if latency:
+            time.sleep(min(latency, timeout))
+        if error is not None:
+            raise error
+        text = self.responder(model_name, prompt, generation_config)
+        return FakeResponse(text, len(prompt) // 4, len(text) // 4)
+
+
+class GeminiClient:
+    """
+    Client Gemini dùng chung: giới hạn RPM/TPM theo model, thử lại 429/503/timeout với backoff có jitter,
+    chuyển gemini-2.5-pro -> flash khi model chính hết quota.
+    """
+
+    def __init__(self, backend=None, limits=GEMINI_LIMITS, fallbacks=FALLBACK_MODELS, timeout=GEMINI_TIMEOUT,
+                 max_retries=GEMINI_MAX_RETRIES, backoff_base=GEMINI_BACKOFF_BASE, backoff_max=GEMINI_BACKOFF_MAX,
+                 fallback_wait=GEMINI_FALLBACK_WAIT):
+        self.backend = backend or GenaiBackend()
+        self.limits = limits
+        self.fallbacks = fallbacks
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fallback_wait = fallback_wait
+        self._quotas = {}
+        self._lock = threading.Lock()
+
+    def quota(self, model_name):
+        with self._lock:
+            quota = self._quotas.get(model_name)
+            if quota is None:
+                rpm, tpm = self.limits.get(model_name, (60, 1_000_000))
+                quota = self._quotas[model_name] = ModelQuota(rpm, tpm)
+            return quota
+
+    def _pick_model(self, model_name, tokens):
+        fallback = self.fallbacks.get(model_name)
+        if not fallback:
+            return model_name
+        wait = self.quota(model_name).wait_time(tokens)
+        if wait > self.fallback_wait and self.quota(fallback).wait_time(tokens) < wait:
+            logging.info("%s hết quota (chờ %.0fs), chuyển sang %s", model_name, wait, fallback)
+            metrics.inc('gemini_fallbacks', model=model_name)
+            return fallback
+        return model_name
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    def generate(self, model_name, prompt, generation_config=None, usage=None, output_tokens=1024):
+        """
+        Gọi Gemini, trả về response (có .text, .usage_metadata). Ném GeminiError khi hết lượt thử
+        """
+        estimate = len(prompt) // 4 + output_tokens
+        last_exc = None
+        for attempt in range(self.max_retries + 1):
+            model = self._pick_model(model_name, estimate)
+            quota = self.quota(model)
+            entry = quota.reserve(estimate)
+            started = time.perf_counter()
+            try:
+                response = self.backend.generate(model, prompt, generation_config, self.timeout)
+            except Exception as e:
+                quota.commit(entry, 0)
+                if not is_retryable(e):
+                    raise GeminiError(f"{model}: {e}") from e
+                last_exc = e
+                delay = self._backoff(attempt)
+                metrics.inc('gemini_retries', model=model)
+                logging.warning("Gemini %s lỗi (%s), thử lại sau %.1fs (%d/%d)",
+                                model, e, delay, attempt + 1, self.max_retries)
+                if attempt >= self.max_retries:
+                    break
+                if _status_code(e) == 429 or type(e).__name__ == 'ResourceExhausted':
+                    # Hết quota: chặn model này, reserve() lần sau tự chờ hoặc _pick_model chuyển model dự phòng
+                    quota.block(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            meta = getattr(response, 'usage_metadata', None)
+            quota.commit(entry, getattr(meta, 'total_token_count', 0) or estimate)
+            record_usage(usage, model, response, started)
+            return response
+        raise GeminiError(f"{model_name}: hết {self.max_retries} lần thử lại: {last_exc}") from last_exc
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_gemini_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GeminiClient()
+        return _client
+
+def set_backend(backend):
+    """
+    Thay backend của client dùng chung (vd. FakeBackend khi chạy thử)
+    """
+    get_gemini_client().backend = backend
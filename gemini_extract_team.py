@@ -1,9 +1,16 @@
-import google.generativeai as genai
-import os
+from gemini_client import get_gemini_client
+from result_cache import get_cache
 
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+TEAM_MODEL = 'gemini-2.5-flash'
+PROMPT_VERSION = 1
 
-def extract_teams_from_url(source_url):
+def extract_teams_from_url(source_url, usage=None):
+    cache = get_cache()
+    parts = {'source_url': source_url, 'model': TEAM_MODEL, 'version': PROMPT_VERSION}
+    if cache:
+        hit = cache.get('teams', parts)
+        if hit:
+            return tuple(hit)
     prompt = f"""
 Bạn là AI chuyên phân tích dữ liệu bóng đá. Hãy vào url {source_url} và chỉ trả về đúng 2 tên đội bóng đang thi đấu (ghi đúng tên tiếng Anh chuẩn của mỗi đội để dùng API quốc tế, không thêm mô tả, không thêm ký tự nào khác, không chèn từ "vs", "and", chỉ in hoa chữ cái đầu, mỗi tên 1 dòng). Định dạng output:
 
@@ -12,8 +19,7 @@ Bạn là AI chuyên phân tích dữ liệu bóng đá. Hãy vào url {source_u
 
 Chỉ trả về tên hai đội, không thêm gì khác.
     """
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    response = model.generate_content([prompt])
+    response = get_gemini_client().generate(TEAM_MODEL, prompt, usage=usage, output_tokens=64)
     text = response.text.strip()
     # Xử lý output chuẩn, loại bỏ rác và tách 2 dòng
     lines = [l.strip() for l in text.split('\n') if l.strip()]
@@ -26,4 +32,6 @@ Chỉ trả về tên hai đội, không thêm gì khác.
             break
     if not team_home or not team_away:
         raise Exception(f"Không extract được tên hai đội: {text}")
+    if cache:
+        cache.set('teams', parts, [team_home, team_away], source_url)
     return team_home, team_away
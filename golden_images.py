@@ -0,0 +1,94 @@
+"""
+So ảnh render_image với ảnh mẫu (golden) trong assets/golden: vài tiêu đề dài ngắn khác nhau trên nền màu trơn,
+không cần mạng. Dùng để kiểm tra sửa layout / đổ bóng không làm đổi giao diện ảnh.
+
+    python golden_images.py             # so với ảnh mẫu, exit 1 nếu khác quá ngưỡng
+    python golden_images.py --update    # ghi lại ảnh mẫu (chỉ khi cố ý đổi giao diện)
+    python golden_images.py --out /tmp/golden   # ghi thêm ảnh vừa render để xem bằng mắt
+"""
+import argparse
+import os
+import sys
+from io import BytesIO
+from PIL import Image, ImageChops
+from image_generator import IMG_SIZE, preload_background, render_image
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'golden')
+SOLID_BG = 'golden://solid'
+BG_COLOR = (32, 64, 96)
+
+# (tên file, tiêu đề): từ 1 dòng tới tiêu đề quá dài phải nới wrap width
+HEADLINES = [
+    ('short', "Arsenal vs Chelsea"),
+    ('medium', "Nhận định bóng đá Manchester United vs Liverpool ngày 25/12/2025"),
+    ('long', "Nhận định bóng đá Manchester United vs Liverpool ngày 25/12/2025: phân tích phong độ và lực lượng"),
+    ('overflow', "Nhận định bóng đá Manchester United vs Liverpool ngày 25/12/2025: phân tích phong độ lực lượng, "
+                 "đội hình dự kiến, lịch sử đối đầu và dự đoán tỷ số chính xác của chuyên gia"),
+    ('markdown', "## **Đội hình dự kiến của Real Madrid và Barcelona**"),
+]
+
+
+def render_all():
+    """
+    {tên: bytes JPEG} render bằng render_image hiện tại (đúng file được upload lên WP)
+    """
+    preload_background(SOLID_BG, Image.new("RGB", IMG_SIZE, BG_COLOR))
+    return {name: render_image(SOLID_BG, text) for name, text in HEADLINES}
+
+def _decode(data):
+    return Image.open(BytesIO(data)).convert("RGB")
+
+def compare(current, golden, threshold):
+    """
+    (số pixel lệch quá threshold mức ở một kênh bất kỳ, độ lệch trung bình)
+    """
+    diff = ImageChops.difference(current, golden)
+    channels = diff.split()
+    over = ImageChops.lighter(ImageChops.lighter(channels[0], channels[1]), channels[2])
+    pixels = sum(over.point(lambda v: 255 if v > threshold else 0).histogram()[255:])
+    mean = sum(i * n for band in channels for i, n in enumerate(band.histogram())) / (3 * diff.width * diff.height)
+    return pixels, mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So ảnh render với ảnh mẫu (golden)")
+    parser.add_argument("--update", action="store_true", help="ghi lại ảnh mẫu từ renderer hiện tại")
+    parser.add_argument("--out", help="thư mục ghi ảnh vừa render")
+    parser.add_argument("--threshold", type=int, default=100, help="mức lệch (0-255) để tính là pixel khác")
+    parser.add_argument("--max-pixels", type=int, default=50, help="số pixel khác tối đa mỗi ảnh")
+    args = parser.parse_args()
+
+    images = render_all()
+    for out_dir in filter(None, (args.out, args.update and GOLDEN_DIR)):
+        os.makedirs(out_dir, exist_ok=True)
+        for name, data in images.items():
+            with open(os.path.join(out_dir, f"{name}.jpg"), 'wb') as f:
+                f.write(data)
+    if args.update:
+        print(f"Đã ghi {len(images)} ảnh mẫu vào {GOLDEN_DIR}")
+        return
+
+    failed = False
+    for name, data in images.items():
+        path = os.path.join(GOLDEN_DIR, f"{name}.jpg")
+        if not os.path.exists(path):
+            print(f"  {name:<9} THIẾU ảnh mẫu {path} (chạy --update)")
+            failed = True
+            continue
+        img = _decode(data)
+        with open(path, 'rb') as f:
+            golden = _decode(f.read())
+        if golden.size != img.size:
+            print(f"  {name:<9} FAIL kích thước {img.size} khác ảnh mẫu {golden.size}")
+            failed = True
+            continue
+        pixels, mean = compare(img, golden, args.threshold)
+        ok = pixels <= args.max_pixels
+        failed = failed or not ok
+        print(f"  {name:<9} {'OK' if ok else 'FAIL'}  {pixels} pixel lệch >{args.threshold}, lệch tb {mean:.2f}")
+    print("FAIL" if failed else "OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
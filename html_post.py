@@ -0,0 +1,172 @@
+import re
+import unicodedata
+
+_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>')
+_HREF_RE = re.compile(r'href="([^"]*)"')
+_ENTITY_RE = re.compile(r'&[a-zA-Z0-9#]+;')
+_HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+
+def postprocess_html(html, anchor_text="", anchor_url="", img2_html="", img3_html=""):
+    """
+    Xử lý HTML từ markdown2 trong một lượt duyệt:
+    - bỏ thẻ <p> bọc ngoài heading (<p><h2>..</h2></p> -> <h2>..</h2>)
+    - chèn internal link <a href="anchor_url"><strong>anchor_text</strong></a> vào lần xuất hiện đầu tiên
+      của anchor_text (ngoài thẻ <a>), trừ khi bài đã có link tới anchor_url
+    - xoá toàn bộ HTML entity (&nbsp;, &amp;...)
+    - chèn img2_html sau H2 đầu tiên và img3_html sau H2 cuối cùng
+    """
+    out = []
+    a_depth = 0
+    link_html = f'<a href="{anchor_url}"><strong>{anchor_text}</strong></a>'
+    link_found = not anchor_text
+    link_piece = None   # (vị trí trong out, text gốc) của link vừa chèn, để gỡ nếu sau đó gặp link có sẵn
+    p_open = None       # vị trí thẻ <p> có thể đang bọc heading
+    p_state = None      # None | 'open' (<p> + khoảng trắng) | 'heading' (trong heading) | 'closed' (heading đã đóng)
+    heading_tag = None
+    first_h2 = last_h2 = None
+
+    pos = 0
+    for m in _TAG_RE.finditer(html):
+        text = html[pos:m.start()]
+        pos = m.end()
+        if text:
+            text = _ENTITY_RE.sub('', text)
+            if p_state in ('open', 'closed') and text.strip():
+                p_state = None
+            if not link_found and link_piece is None and a_depth == 0 and anchor_text in text:
+                i = text.index(anchor_text)
+                link_piece = (len(out), text)
+                text = text[:i] + link_html + text[i + len(anchor_text):]
+            out.append(text)
+
+        closing, name = m.group(1) == '/', m.group(2).lower()
+        tag = _ENTITY_RE.sub('', m.group(0))
+
+        if name == 'p' and not closing:
+            p_open, p_state = len(out), 'open'
+        elif name == 'p' and closing:
+            if p_state == 'closed':
+                # <p><hN>..</hN></p>: bỏ <p>, khoảng trắng cuối và </p>
+                out[p_open] = ''
+                while out and out[-1].isspace():
+                    out.pop()
+                p_state = None
+                continue
+            p_state = None
+        elif name in _HEADINGS and not closing:
+            if p_state == 'open':
+                p_state, heading_tag = 'heading', name
+            elif p_state != 'heading':
+                p_state = None
+        elif name in _HEADINGS and closing and p_state == 'heading' and name == heading_tag:
+            p_state = 'closed'
+        elif p_state in ('open', 'closed'):
+            p_state = None
+
+        if name == 'a' and not closing:
+            a_depth += 1
+            href = _HREF_RE.search(tag)
+            if anchor_url and href and href.group(1) == anchor_url:
+                link_found = True
+                if link_piece:
+                    out[link_piece[0]] = link_piece[1]
+                    link_piece = None
+        elif name == 'a' and closing:
+            a_depth = max(0, a_depth - 1)
+
+        out.append(tag)
+        if name == 'h2' and closing:
+            if first_h2 is None:
+                first_h2 = len(out)
+            last_h2 = len(out)
+
+    tail = html[pos:]
+    if tail:
+        tail = _ENTITY_RE.sub('', tail)
+        if not link_found and link_piece is None and a_depth == 0 and anchor_text in tail:
+            tail = tail.replace(anchor_text, link_html, 1)
+        out.append(tail)
+
+    # Chèn vị trí sau trước để vị trí trước không bị lệch
+    if img3_html and last_h2 is not None:
+        out.insert(last_h2, img3_html)
+    if img2_html and first_h2 is not None:
+        out.insert(first_h2, img2_html)
+    return ''.join(out)
+
+def slugify(text):
+    # Chuyển đ/Đ thành d/D để slug chuẩn SEO (tên file ảnh upload lên WP)
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    text = re.sub(r"[^\w\s-]", '', text.lower())
+    text = re.sub(r"[\s]+", '-', text)
+    text = text.strip('-')
+    if not text:
+        text = "image"
+    return text
+
+
+def _legacy_chain(html, anchor_text, anchor_url, img2_html, img3_html):
+    # Chuỗi xử lý cũ (regex + ensure_internal_link + xoá entity + BeautifulSoup), chỉ dùng để benchmark
+    from bs4 import BeautifulSoup
+    html = re.sub(r'<p>(\s*<h[1-6][^>]*>.*?</h[1-6]>)\s*</p>', r'\1', html, flags=re.DOTALL)
+    if f'<a href="{anchor_url}"><strong>{anchor_text}</strong></a>' not in html \
+            and f'<a href="{anchor_url}"><b>{anchor_text}</b></a>' not in html:
+        pattern = rf'(?<![">])({re.escape(anchor_text)})(?!<\/a>)'
+        html = re.sub(pattern, lambda m: f'<a href="{anchor_url}"><strong>{anchor_text}</strong></a>', html, count=1)
+    html = _ENTITY_RE.sub('', html)
+    soup = BeautifulSoup(html, "lxml")
+    h2s = soup.find_all('h2')
+    if h2s and img2_html:
+        h2s[0].insert_after(BeautifulSoup(img2_html, "lxml"))
+    if h2s and img3_html:
+        h2s[-1].insert_after(BeautifulSoup(img3_html, "lxml"))
+    return soup.body.decode_contents() if soup.body else str(soup)
+
+
+def _benchmark(corpus_dir, repeat=5):
+    """
+    So sánh thời gian + bộ nhớ đỉnh của postprocess_html với chuỗi cũ trên các file markdown Gemini đã lưu (*.md)
+    """
+    import glob
+    import time
+    import tracemalloc
+    import markdown2
+    from content_writer import clean_markdown, extract_h1_and_remove
+
+    docs = []
+    for path in sorted(glob.glob(f"{corpus_dir}/*.md")):
+        with open(path, encoding='utf-8') as f:
+            _, md = extract_h1_and_remove(clean_markdown(f.read()))
+        docs.append(markdown2.markdown(md, extras=["tables", "fenced-code-blocks", "strike", "cuddled-lists"]))
+    if not docs:
+        print(f"Không có file .md nào trong {corpus_dir}")
+        return
+    fig = '<figure class="wp-caption aligncenter"><img src="https://example.com/a.jpg" alt="a"></figure>'
+    args = ("soi kèo", "https://example.com/soi-keo", fig, fig)
+
+    for label, func in (("postprocess_html", postprocess_html), ("chuỗi cũ (bs4)", _legacy_chain)):
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for html in docs:
+                    func(html, *args)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+        except ImportError as e:
+            print(f"{label}: bỏ qua ({e})")
+            continue
+        finally:
+            tracemalloc.stop()
+        per_doc = elapsed / (repeat * len(docs)) * 1000
+        print(f"{label}: {per_doc:.2f} ms/bài, bộ nhớ đỉnh {peak / 1024:.0f} KB ({len(docs)} bài x {repeat} lần)")
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Cách dùng: python html_post.py <thư mục chứa các file .md Gemini đã lưu> [số lần lặp]")
+        sys.exit(1)
+    _benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -1,75 +1,239 @@
 import requests
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 from io import BytesIO
-import re
-import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+import threading
+import time
 import os
 import textwrap
 
 FONT_PATH = "assets/NotoSans-Regular.ttf"
+IMG_SIZE = (800, 450)
 
-def slugify(text):
-    # Chuyển đ/Đ thành d/D để slug chuẩn SEO
-    text = text.replace('đ', 'd').replace('Đ', 'D')
-    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
-    text = re.sub(r"[^\w\s-]", '', text.lower())
-    text = re.sub(r"[\s]+", '-', text)
-    text = text.strip('-')
-    if not text:
-        text = "image"
-    return text
+# Cache ảnh nền đã decode + resize: LRU trong RAM, thêm cache trên đĩa nếu đặt BG_CACHE_DIR
+BG_CACHE_SIZE = int(os.getenv('BG_CACHE_SIZE', '32'))
+BG_CACHE_TTL = int(os.getenv('BG_CACHE_TTL', '600'))
+BG_CACHE_DIR = os.getenv('BG_CACHE_DIR')
+BG_TIMEOUT = float(os.getenv('BG_TIMEOUT', '30'))
+
+_bg_cache = OrderedDict()  # (url, size) -> (etag, fetched_at, image)
+_bg_lock = threading.Lock()
+_http = requests.Session()
 
 def download_image(url):
-    response = requests.get(url)
+    response = requests.get(url, timeout=BG_TIMEOUT)
     return Image.open(BytesIO(response.content)).convert("RGB")  # JPG là RGB
 
-def compose_image(bg_url, text, out_name, max_width_ratio=0.82, max_height_ratio=0.55):
-    import requests
-    import textwrap
-    from io import BytesIO
+@lru_cache(maxsize=None)
+def get_font(size):
+    return ImageFont.truetype(FONT_PATH, size)
+
+def _disk_paths(url, size):
+    key = hashlib.sha1(f"{url}|{size[0]}x{size[1]}".encode('utf-8')).hexdigest()
+    return os.path.join(BG_CACHE_DIR, f"{key}.png"), os.path.join(BG_CACHE_DIR, f"{key}.etag")
+
+def _load_from_disk(url, size):
+    if not BG_CACHE_DIR:
+        return None
+    img_path, etag_path = _disk_paths(url, size)
+    if not os.path.exists(img_path):
+        return None
+    try:
+        img = Image.open(img_path).convert("RGB")
+        etag = None
+        if os.path.exists(etag_path):
+            with open(etag_path, encoding='utf-8') as f:
+                etag = f.read().strip() or None
+        return etag, os.path.getmtime(img_path), img
+    except OSError:
+        return None
+
+def _save_to_disk(url, size, etag, img):
+    if not BG_CACHE_DIR:
+        return
+    try:
+        os.makedirs(BG_CACHE_DIR, exist_ok=True)
+        img_path, etag_path = _disk_paths(url, size)
+        img.save(img_path, "PNG")
+        with open(etag_path, 'w', encoding='utf-8') as f:
+            f.write(etag or "")
+    except OSError:
+        pass
+
+def _store(key, entry):
+    with _bg_lock:
+        _bg_cache[key] = entry
+        _bg_cache.move_to_end(key)
+        while len(_bg_cache) > BG_CACHE_SIZE:
+            _bg_cache.popitem(last=False)
+
+def load_background(url, size=IMG_SIZE):
+    """
+    Trả về bản copy ảnh nền (RGB, mặc định 800x450) của url.
+    Trong BG_CACHE_TTL giây dùng thẳng cache, quá hạn thì hỏi lại server bằng ETag (If-None-Match).
+    """
+    size = tuple(size)
+    key = (url, size)
+    with _bg_lock:
+        entry = _bg_cache.get(key)
+        if entry:
+            _bg_cache.move_to_end(key)
+    if entry is None:
+        entry = _load_from_disk(url, size)
+        if entry:
+            _store(key, entry)
+
+    if entry and time.time() - entry[1] < BG_CACHE_TTL:
+        return entry[2].copy()
+
+    headers = {'If-None-Match': entry[0]} if entry and entry[0] else {}
+    response = _http.get(url, headers=headers, timeout=BG_TIMEOUT)
+    if response.status_code == 304 and entry:
+        entry = (entry[0], time.time(), entry[2])
+    else:
+        response.raise_for_status()
+        img = Image.open(BytesIO(response.content)).convert("RGB").resize(size)
+        entry = (response.headers.get('ETag'), time.time(), img)
+        _save_to_disk(url, size, entry[0], img)
+    _store(key, entry)
+    return entry[2].copy()
+
+def preload_background(url, img, size=IMG_SIZE):
+    """
+    Đặt sẵn ảnh nền của url vào cache RAM (vd. nền màu trơn khi so ảnh mẫu, không cần mạng)
+    """
+    size = tuple(size)
+    _store((url, size), (None, time.time(), img.convert("RGB").resize(size)))
+
+def clear_background_cache():
+    with _bg_lock:
+        _bg_cache.clear()
+
+FONT_MAX_SIZE = 64
+FONT_MIN_SIZE = 24
+FONT_STEP = 2
+LINE_GAP = 14
+WRAP_WIDTH = 24
+WRAP_MAX_WIDTH = 36
+SHADOW_OFFSETS = [(2, 2), (-2, -2), (2, -2), (-2, 2)]
+
+@lru_cache(maxsize=8192)
+def _text_width(size, text):
+    return get_font(size).getlength(text)
 
+@lru_cache(maxsize=None)
+def _line_height(size):
+    bbox = get_font(size).getbbox("A")
+    return bbox[3] - bbox[1] + LINE_GAP
+
+@lru_cache(maxsize=1024)
+def _wrap(text, wrap_width):
+    return tuple(textwrap.wrap(text, width=wrap_width))
+
+def _fits(lines, size, max_w, max_h):
+    max_line_w = max((_text_width(size, line) for line in lines), default=0)
+    return max_line_w <= max_w and len(lines) * _line_height(size) <= max_h
+
+def layout_text(text, max_w, max_h):
+    """
+    Tìm font size lớn nhất (64 -> 26, bước 2) để text vừa khung, bằng tìm kiếm nhị phân.
+    Thử wrap width 24 trước (giống cách cũ); chỉ khi không size nào vừa mới nới wrap width tới 36.
+    Không vừa ở đâu cả thì dùng font 24 với wrap 24 như trước. Trả về (font_size, lines).
+    """
+    sizes = list(range(FONT_MIN_SIZE + FONT_STEP, FONT_MAX_SIZE + 1, FONT_STEP))
+    for wrap_width in range(WRAP_WIDTH, WRAP_MAX_WIDTH + 1):
+        lines = _wrap(text, wrap_width)
+        lo, hi, best = 0, len(sizes) - 1, None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            if _fits(lines, sizes[mid], max_w, max_h):
+                best = sizes[mid]
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        if best:
+            return best, lines
+    return FONT_MIN_SIZE, _wrap(text, WRAP_WIDTH)
+
+def warm_fonts():
+    """
+    Nạp sẵn font + chiều cao dòng cho mọi font size mà layout_text có thể dùng
+    """
+    for size in range(FONT_MIN_SIZE, FONT_MAX_SIZE + 1, FONT_STEP):
+        _line_height(size)
+
+def render_image(bg_url, text, max_width_ratio=0.82, max_height_ratio=0.55, quality=95, size=IMG_SIZE):
+    """
+    Vẽ text lên ảnh nền, trả về bytes JPEG (không ghi file)
+    """
     # Làm sạch text
     text = text.lstrip("#* ").strip()
 
-    response = requests.get(bg_url)
-    bg = Image.open(BytesIO(response.content)).resize((800, 450))
-    draw = ImageDraw.Draw(bg)
-
+    bg = load_background(bg_url, size)
     img_w, img_h = bg.size
-    max_text_width = int(img_w * max_width_ratio)
-    max_text_height = int(img_h * max_height_ratio)
-
-    # Bắt đầu thử font size lớn rồi giảm dần
-    font_size = 64
-    font = ImageFont.truetype(FONT_PATH, font_size)
-    lines = [text]
-    while font_size > 24:
-        # Tự wrap text lại cho dòng dài hơn
-        wrap_width = 24
-        lines = textwrap.wrap(text, width=wrap_width)
-        max_line_w = max(draw.textlength(line, font=font) for line in lines)
-        total_text_h = len(lines) * (font.getbbox("A")[3] - font.getbbox("A")[1] + 14)
-        if max_line_w <= max_text_width and total_text_h <= max_text_height:
-            break
-        font_size -= 2
-        font = ImageFont.truetype(FONT_PATH, font_size)
-        # Nới wrap width cho font nhỏ hơn
-        wrap_width = min(36, wrap_width + 1)
-
-    # Tính toạ độ block text để căn giữa
-    total_text_h = len(lines) * (font.getbbox("A")[3] - font.getbbox("A")[1] + 14)
-    y_text = (img_h - total_text_h) // 2
+    font_size, lines = layout_text(text, int(img_w * max_width_ratio), int(img_h * max_height_ratio))
+    font = get_font(font_size)
+    line_h = _line_height(font_size)
 
+    # Vẽ cả khối chữ một lần vào mask, căn giữa từng dòng
+    text_mask = Image.new("L", bg.size, 0)
+    mask_draw = ImageDraw.Draw(text_mask)
+    y_text = (img_h - len(lines) * line_h) // 2
     for line in lines:
-        line_w = draw.textlength(line, font=font)
-        x_text = (img_w - line_w) // 2
-        # Đổ bóng cho chữ (shadow)
-        shadow_xy = [(x_text+2, y_text+2), (x_text-2, y_text-2), (x_text+2, y_text-2), (x_text-2, y_text+2)]
-        for sx, sy in shadow_xy:
-            draw.text((sx, sy), line, font=font, fill="black")
-        # Chữ chính màu trắng
-        draw.text((x_text, y_text), line, font=font, fill="white")
-        y_text += (font.getbbox("A")[3] - font.getbbox("A")[1] + 14)
-
-    bg.save(out_name, "JPEG", quality=95)
+        x_text = (img_w - _text_width(font_size, line)) // 2
+        mask_draw.text((x_text, y_text), line, font=font, fill=255)
+        y_text += line_h
+
+    # Đổ bóng: gộp mask lệch 4 góc chéo thành một lớp rồi phủ đen một lần
+    shadow_mask = Image.new("L", bg.size, 0)
+    for dx, dy in SHADOW_OFFSETS:
+        shifted = Image.new("L", bg.size, 0)
+        shifted.paste(text_mask, (dx, dy))
+        shadow_mask = ImageChops.lighter(shadow_mask, shifted)
+    bg.paste((0, 0, 0), (0, 0, img_w, img_h), shadow_mask)
+    # Chữ chính màu trắng
+    bg.paste((255, 255, 255), (0, 0, img_w, img_h), text_mask)
+
+    buf = BytesIO()
+    bg.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def compose_image(bg_url, text, out_name, max_width_ratio=0.82, max_height_ratio=0.55):
+    data = render_image(bg_url, text, max_width_ratio, max_height_ratio)
+    with open(out_name, 'wb') as f:
+        f.write(data)
     return out_name
+
+def _benchmark(bg_url, n=20):
+    text = "Nhận định bóng đá Manchester United vs Liverpool ngày 25/12/2025"
+    clear_background_cache()
+    start = time.perf_counter()
+    for _ in range(n):
+        clear_background_cache()
+        render_image(bg_url, text)
+    uncached = n / (time.perf_counter() - start)
+    render_image(bg_url, text)
+    start = time.perf_counter()
+    for _ in range(n):
+        render_image(bg_url, text)
+    cached = n / (time.perf_counter() - start)
+    print(f"không cache: {uncached:.2f} ảnh/s | có cache: {cached:.2f} ảnh/s")
+
+    # Thời gian layout + vẽ theo độ dài tiêu đề (đo lần đầu, chưa có cache đo chữ)
+    words = (text + " phân tích phong độ lực lượng và dự đoán tỷ số chính xác").split()
+    for n_words in (4, 8, 12, 16, len(words)):
+        headline = " ".join(words[:n_words])
+        _text_width.cache_clear()
+        _wrap.cache_clear()
+        start = time.perf_counter()
+        render_image(bg_url, headline)
+        print(f"{len(headline):>3} ký tự: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Cách dùng: python image_generator.py <url ảnh nền> [số ảnh]")
+        sys.exit(1)
+    _benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 20)
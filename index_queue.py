@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import requests
+from metrics import metrics
+
+SINBYTE_API_URL = os.getenv('SINBYTE_API_URL', 'https://app.sinbyte.com/api/indexing/')
+INDEX_QUEUE_PATH = os.getenv('INDEX_QUEUE_PATH', 'data/index_queue.sqlite3')
+INDEX_BATCH_SIZE = int(os.getenv('INDEX_BATCH_SIZE', '20'))
+INDEX_MAX_AGE = float(os.getenv('INDEX_MAX_AGE', '300'))  # giây link được chờ gom batch trước khi gửi
+INDEX_FLUSH_INTERVAL = float(os.getenv('INDEX_FLUSH_INTERVAL', '30'))
+INDEX_RETRY_BASE = float(os.getenv('INDEX_RETRY_BASE', '60'))
+INDEX_MAX_ATTEMPTS = int(os.getenv('INDEX_MAX_ATTEMPTS', '6'))
+# Link đã failed (hết INDEX_MAX_ATTEMPTS lần) được đưa lại hàng đợi sau mỗi khoảng này: Sinbyte sập lâu cũng không mất link
+INDEX_REQUEUE_INTERVAL = float(os.getenv('INDEX_REQUEUE_INTERVAL', str(6 * 3600)))
+
+
+def submit_index_sinbyte(api_key, post_urls, name=None, dripfeed=1, api_url=SINBYTE_API_URL, session=None):
+    headers = {"Content-Type": "application/json"}
+    if name is None:
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        name = f"Nordic {current_time}"
+    data = {
+        "apikey": api_key,
+        "name": name,
+        "dripfeed": dripfeed,
+        "urls": post_urls if isinstance(post_urls, list) else [post_urls]
+    }
+    try:
+        resp = (session or requests).post(api_url, headers=headers, json=data, timeout=30)
+        return resp.status_code, resp.text
+    except Exception as e:
+        return 0, str(e)
+
+
+class IndexQueue:
+    """
+    Hàng đợi ép index Sinbyte lưu trên SQLite: mỗi link được thêm ngay khi đăng bài, không bao giờ gửi trùng.
+    Link được gom theo website, gửi khi đủ INDEX_BATCH_SIZE hoặc link cũ nhất đã chờ quá INDEX_MAX_AGE giây.
+    Gửi lỗi thì thử lại với backoff (INDEX_RETRY_BASE * 2^lần thử), quá INDEX_MAX_ATTEMPTS thì đánh dấu failed.
+    """
+
+    def __init__(self, path=INDEX_QUEUE_PATH, api_key=None, api_url=SINBYTE_API_URL, batch_size=INDEX_BATCH_SIZE,
+                 max_age=INDEX_MAX_AGE, retry_base=INDEX_RETRY_BASE, max_attempts=INDEX_MAX_ATTEMPTS):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.retry_base = retry_base
+        self.max_attempts = max_attempts
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS links ("
+            " url TEXT PRIMARY KEY, website TEXT, status TEXT, attempts INTEGER,"
+            " next_attempt REAL, created REAL, submitted REAL, last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_links_status ON links(status, website)")
+        self._conn.commit()
+
+    def enqueue(self, website, url):
+        """
+        Thêm link vào hàng đợi. Trả về False nếu link đã có (đang chờ hoặc đã gửi)
+        """
+        if not url:
+            return False
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO links (url, website, status, attempts, next_attempt, created)"
+                " VALUES (?, ?, 'pending', 0, ?, ?)",
+                (url, website, now, now),
+            )
+            self._conn.commit()
+            return cur.rowcount == 1
+
+    def due_batches(self, force=False, urls=None):
+        """
+        [(website, [url, ...])] đến hạn gửi: đủ batch_size, quá max_age, hoặc force.
+        urls: chỉ xét các link này (vd. link của một job), link khác để vòng lặp nền gửi
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT website, url, created FROM links WHERE status = 'pending' AND next_attempt <= ?"
+                " ORDER BY created", (now,)
+            ).fetchall()
+        if urls is not None:
+            urls = set(urls)
+            rows = [row for row in rows if row[1] in urls]
+        by_site = {}
+        for website, url, created in rows:
+            by_site.setdefault(website, []).append((url, created))
+        batches = []
+        for website, items in by_site.items():
+            oldest = items[0][1]
+            if not (force or len(items) >= self.batch_size or now - oldest >= self.max_age):
+                continue
+            urls = [url for url, _ in items]
+            for i in range(0, len(urls), self.batch_size):
+                chunk = urls[i:i + self.batch_size]
+                # Batch lẻ cuối chỉ gửi khi đã đủ tuổi / force, còn lại chờ gom thêm
+                if len(chunk) < self.batch_size and not (force or now - oldest >= self.max_age):
+                    break
+                batches.append((website, chunk))
+        return batches
+
+    def _mark(self, urls, ok, error=None):
+        now = time.time()
+        with self._lock:
+            for url in urls:
+                if ok:
+                    self._conn.execute(
+                        "UPDATE links SET status = 'submitted', submitted = ?, last_error = NULL WHERE url = ?",
+                        (now, url),
+                    )
+                else:
+                    attempts = self._conn.execute("SELECT attempts FROM links WHERE url = ?", (url,)).fetchone()[0] + 1
+                    status = 'failed' if attempts >= self.max_attempts else 'pending'
+                    self._conn.execute(
+                        "UPDATE links SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE url = ?",
+                        (status, attempts, now + self.retry_base * 2 ** (attempts - 1), error, url),
+                    )
+            self._conn.commit()
+
+    def flush(self, force=False, urls=None):
+        """
+        Gửi các batch đến hạn (blocking), chỉ trong urls nếu có. Trả về [(website, số link, ok, nội dung phản hồi)]
+        """
+        if not self.api_key:
+            return []
+        results = []
+        with self._flush_lock:
+            for website, batch in self.due_batches(force, urls):
+                started = time.perf_counter()
+                status, resp_text = submit_index_sinbyte(
+                    self.api_key, batch, name=f"{website} {datetime.now():%Y-%m-%d %H:%M:%S}",
+                    api_url=self.api_url, session=self.session,
+                )
+                ok = status == 200
+                metrics.observe('index', time.perf_counter() - started, ok, website=website)
+                self._mark(batch, ok, None if ok else f"{status}: {resp_text[:500]}")
+                if not ok:
+                    metrics.inc('index_failures', website=website)
+                    logging.warning("Sinbyte index fail (%s) cho %s: %s", status, website, resp_text[:500])
+                results.append((website, len(batch), ok, resp_text))
+        return results
+
+    def retry_failed(self):
+        """
+        Đưa các link đã failed về hàng đợi để thử lại từ đầu
+        """
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE links SET status = 'pending', attempts = 0, next_attempt = ? WHERE status = 'failed'",
+                (time.time(),),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM links GROUP BY status").fetchall())
+
+    async def run(self, interval=INDEX_FLUSH_INTERVAL, requeue_interval=INDEX_REQUEUE_INTERVAL):
+        """
+        Vòng lặp nền: định kỳ gửi các batch đến hạn (kể cả link đang chờ retry),
+        mỗi requeue_interval giây đưa các link failed về hàng đợi
+        """
+        last_requeue = time.monotonic()
+        while True:
+            try:
+                if time.monotonic() - last_requeue >= requeue_interval:
+                    last_requeue = time.monotonic()
+                    requeued = await asyncio.to_thread(self.retry_failed)
+                    if requeued:
+                        logging.info("Đưa lại %d link index failed vào hàng đợi", requeued)
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logging.exception("IndexQueue flush lỗi")
+            await asyncio.sleep(interval)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_index_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IndexQueue(api_key=os.getenv('SINBYTE_API_KEY'))
+        return _queue
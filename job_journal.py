@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+JOURNAL_PATH = os.getenv('JOB_JOURNAL_PATH', 'data/journal.sqlite3')
+
+# Các mốc của một dòng key_word, theo thứ tự
+STAGES = ('teams', 'post', 'images', 'published')
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def reached(stage, target):
+    """
+    True nếu stage đã qua (hoặc bằng) mốc target
+    """
+    return stage in STAGES and STAGES.index(stage) >= STAGES.index(target)
+
+
+class JobJournal:
+    """
+    Nhật ký tiến độ theo (hash file Excel, dòng): mốc đã hoàn thành + dữ liệu cần để chạy tiếp
+    (tên đội, bài viết, media ID, link bài). Dùng để chạy tiếp sau khi worker restart / upload lại file.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            " file_hash TEXT, row_idx INTEGER, stage TEXT, data TEXT, updated REAL,"
+            " PRIMARY KEY (file_hash, row_idx))"
+        )
+        self._conn.commit()
+
+    def get(self, fhash, row_idx):
+        """
+        Trả về (stage, data) của dòng, (None, {}) nếu chưa chạy lần nào
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stage, data FROM rows WHERE file_hash = ? AND row_idx = ?", (fhash, row_idx)
+            ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def record(self, fhash, row_idx, stage, **data):
+        """
+        Đánh dấu dòng đã xong mốc stage, gộp thêm data vào dữ liệu đã lưu
+        """
+        if stage not in STAGES:
+            raise ValueError(f"stage không hợp lệ: {stage}")
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM rows WHERE file_hash = ? AND row_idx = ?", (fhash, row_idx)
+            ).fetchone()
+            merged = json.loads(row[0]) if row else {}
+            merged.update(data)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rows (file_hash, row_idx, stage, data, updated) VALUES (?, ?, ?, ?, ?)",
+                (fhash, row_idx, stage, json.dumps(merged, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_journal():
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = JobJournal()
+        return _journal
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from job_journal import file_hash
+
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', 'data/jobs.sqlite3')
+JOBS_DIR = os.getenv('JOBS_DIR', 'data/jobs')
+# Số file Excel chạy đồng thời (mỗi file vẫn chạy MAX_WORKERS dòng song song)
+JOB_CONCURRENCY = int(os.getenv('JOB_CONCURRENCY', '2'))
+
+
+def new_job_dir(chat_id):
+    """
+    Thư mục riêng cho một file upload (xlsx...), bị xoá khi job kết thúc
+    """
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{chat_id}-", dir=JOBS_DIR)
+
+def _job_dir(file_path):
+    """
+    Thư mục job chứa file_path, None nếu file không nằm trong JOBS_DIR (không được xoá)
+    """
+    job_dir = os.path.dirname(os.path.abspath(file_path))
+    if os.path.dirname(job_dir) != os.path.abspath(JOBS_DIR):
+        return None
+    return job_dir
+
+
+class JobCancelled(Exception):
+    """
+    Job bị huỷ bằng /cancel, ném ra ở điểm kiểm tra giữa các stage của một dòng
+    """
+
+
+class RunningJob:
+    """
+    Job đang chạy: thông tin truyền cho runner + cờ huỷ + notifier (để /status đọc tiến độ)
+    """
+
+    def __init__(self, job_id, chat_id, file_name, file_path, fhash=None):
+        self.id = job_id
+        self.chat_id = chat_id
+        self.file_name = file_name
+        self.file_path = file_path
+        self.file_hash = fhash
+        self.cancel_event = asyncio.Event()
+        self.notify = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Job #{self.id} đã bị huỷ")
+
+
+class JobManager:
+    """
+    Hàng đợi file Excel lưu trên SQLite: chạy tối đa JOB_CONCURRENCY job cùng lúc,
+    lần lượt xoay vòng giữa các chat (chat đang ít job chạy nhất / lâu chưa được chạy nhất đi trước).
+    Job đang chạy hoặc đang chờ khi bot restart được chạy lại khi khởi động (job journal giúp bỏ qua dòng đã xong).
+    Hai job cùng một file (cùng hash) không chạy cùng lúc: job sau chờ job trước xong rồi chỉ chạy các dòng còn lại.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH, max_concurrent=JOB_CONCURRENCY):
+        self.max_concurrent = max(1, max_concurrent)
+        self._lock = threading.Lock()
+        self._running = {}       # job_id -> RunningJob
+        self._last_served = {}   # chat_id -> số thứ tự lần cuối được chạy job
+        self._served = 0
+        self._wake = None
+        self._loop = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, file_name TEXT, file_path TEXT,"
+            " status TEXT, created REAL, started REAL, finished REAL, error TEXT, file_hash TEXT)"
+        )
+        # DB tạo trước khi có cột file_hash
+        if 'file_hash' not in [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN file_hash TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created)")
+        self._conn.commit()
+
+    def _set(self, job_id, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def submit(self, chat_id, file_name, file_path):
+        """
+        Thêm file vào hàng đợi, trả về ID job (blocking: tính hash file)
+        """
+        fhash = file_hash(file_path)
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO jobs (chat_id, file_name, file_path, status, created, file_hash)"
+                " VALUES (?, ?, ?, 'queued', ?, ?)",
+                (chat_id, file_name, file_path, time.time(), fhash),
+            )
+            self._conn.commit()
+            job_id = cur.lastrowid
+        self._notify_wake()
+        return job_id
+
+    def get(self, job_id):
+        """
+        dict thông tin job, None nếu không có
+        """
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cur.description], row))
+
+    def jobs(self, chat_id=None, limit=10):
+        """
+        Các job mới nhất (của một chat), mới nhất trước
+        """
+        sql = "SELECT id, chat_id, file_name, status, created, started, finished FROM jobs"
+        params = ()
+        if chat_id is not None:
+            sql += " WHERE chat_id = ?"
+            params = (chat_id,)
+        with self._lock:
+            cur = self._conn.execute(sql + " ORDER BY id DESC LIMIT ?", (*params, limit))
+            cols = [c[0] for c in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def queue_position(self, job_id):
+        """
+        Số job đang chờ trước job này (xấp xỉ, theo thứ tự gửi)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id < ?", (job_id,)
+            ).fetchone()[0]
+
+    def duplicate_of(self, job_id):
+        """
+        ID job cùng file gửi trước đó còn đang chờ / đang chạy (job_id sẽ chạy sau nó), None nếu không có
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT d.id FROM jobs j JOIN jobs d ON d.file_hash = j.file_hash AND d.id < j.id"
+                " WHERE j.id = ? AND d.status IN ('queued', 'running') ORDER BY d.id LIMIT 1", (job_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def running(self, job_id):
+        return self._running.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Huỷ job: job đang chờ bị bỏ ngay, job đang chạy dừng ở điểm kiểm tra kế tiếp.
+        Trả về trạng thái trước khi huỷ (None nếu không có job)
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job['status'] == 'queued':
+            self._set(job_id, status='cancelled', finished=time.time())
+            self.cleanup(job_id)
+        elif job_id in self._running:
+            self._running[job_id].cancel_event.set()
+        return job['status']
+
+    def _recover(self):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+            self._conn.commit()
+            queued = [row[0] for row in self._conn.execute("SELECT file_path FROM jobs WHERE status = 'queued'")]
+        # Dọn thư mục của các job đã kết thúc / upload dở từ lần chạy trước
+        keep = {_job_dir(path) for path in queued}
+        if os.path.isdir(JOBS_DIR):
+            for name in os.listdir(JOBS_DIR):
+                path = os.path.abspath(os.path.join(JOBS_DIR, name))
+                # Bỏ qua thư mục vừa tạo: có thể là file đang được tải về trước khi submit
+                if os.path.isdir(path) and path not in keep and time.time() - os.path.getmtime(path) > 600:
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def cleanup(self, job_id):
+        """
+        Xoá thư mục job (file Excel đã upload) khi job kết thúc
+        """
+        job = self.get(job_id)
+        job_dir = _job_dir(job['file_path']) if job else None
+        if job_dir:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _next_job(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, chat_id, file_name, file_path, file_hash FROM jobs WHERE status = 'queued' ORDER BY id"
+            ).fetchall()
+        # Cùng file với job đang chạy: chờ, nếu không cả hai cùng đăng các dòng chưa có trong journal
+        running_hashes = {job.file_hash for job in self._running.values() if job.file_hash}
+        rows = [row for row in rows if row[4] not in running_hashes]
+        if not rows:
+            return None
+        running_per_chat = {}
+        for job in self._running.values():
+            running_per_chat[job.chat_id] = running_per_chat.get(job.chat_id, 0) + 1
+        first_per_chat = {}
+        for row in rows:
+            first_per_chat.setdefault(row[1], row)
+        return min(
+            first_per_chat.values(),
+            key=lambda row: (running_per_chat.get(row[1], 0), self._last_served.get(row[1], -1), row[0]),
+        )
+
+    def _notify_wake(self):
+        wake = self._wake
+        if wake is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is self._loop:
+            wake.set()
+        else:
+            self._loop.call_soon_threadsafe(wake.set)
+
+    async def _run_one(self, job, runner):
+        status, error = 'done', None
+        try:
+            await runner(job)
+            if job.cancelled:
+                status = 'cancelled'
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            logging.exception("Job #%s lỗi", job.id)
+            status, error = 'failed', str(e)[:1000]
+        finally:
+            self._running.pop(job.id, None)
+            self._set(job.id, status=status, finished=time.time(), error=error)
+            await asyncio.to_thread(self.cleanup, job.id)
+            self._wake.set()
+
+    async def run(self, runner):
+        """
+        Vòng lặp nền: lấy job theo lượt công bằng giữa các chat và chạy runner(RunningJob)
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self._recover)
+        while True:
+            self._wake.clear()
+            while len(self._running) < self.max_concurrent:
+                row = self._next_job()
+                if row is None:
+                    break
+                job_id, chat_id, file_name, file_path, fhash = row
+                self._served += 1
+                self._last_served[chat_id] = self._served
+                self._set(job_id, status='running', started=time.time())
+                job = self._running[job_id] = RunningJob(job_id, chat_id, file_name, file_path, fhash)
+                asyncio.create_task(self._run_one(job, runner))
+            await self._wake.wait()
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_job_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
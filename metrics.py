@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Ghi từng lần đo ra file JSON lines nếu đặt METRICS_JSONL; ghi định kỳ dạng Prometheus text nếu đặt METRICS_PROM_FILE
+METRICS_JSONL = os.getenv('METRICS_JSONL')
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE')
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+# Các stage của pipeline, theo thứ tự hiển thị ở /stats
+STAGES = ('teams', 'generate', 'caption', 'render', 'upload', 'html', 'publish', 'index', 'telegram')
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, ok=True):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+        if not ok:
+            self.errors += 1
+
+    def quantile(self, q):
+        """
+        Ước lượng phân vị theo cận trên của bucket
+        """
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return BUCKETS[-1]
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class Metrics:
+    """
+    Đo đạc nhẹ cho pipeline: histogram độ trễ theo stage (+ website / model), bộ đếm (retry...) và token theo model / website.
+    Chỉ là cập nhật dict trong RAM dưới một lock, đủ rẻ để bật thường trực.
+    """
+
+    def __init__(self, jsonl_path=METRICS_JSONL):
+        self._lock = threading.Lock()
+        self.jsonl_path = jsonl_path
+        self.reset()
+
+    def reset(self):
+        """
+        Xoá toàn bộ số liệu (dùng giữa các lượt benchmark)
+        """
+        with self._lock:
+            self.started_at = time.time()
+            self.histograms = {}   # (stage, labels) -> Histogram
+            self.counters = {}     # (name, labels) -> số
+            self.tokens = {}       # (model, website) -> [prompt, output, calls]
+
+    def observe(self, stage, seconds, ok=True, **labels):
+        key = (stage, _labels_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(seconds, ok)
+        self._log({'type': 'latency', 'stage': stage, 'seconds': round(seconds, 4), 'ok': ok, **labels})
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """
+        with metrics.timer('upload', website=...): ...  (dùng được cả quanh await)
+        """
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(stage, time.perf_counter() - started, ok, **labels)
+
+    def inc(self, name, n=1, **labels):
+        if not n:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+        self._log({'type': 'counter', 'name': name, 'n': n, **labels})
+
+    def record_tokens(self, model, prompt_tokens, output_tokens, website=None):
+        key = (model, website or '')
+        with self._lock:
+            entry = self.tokens.setdefault(key, [0, 0, 0])
+            entry[0] += prompt_tokens
+            entry[1] += output_tokens
+            entry[2] += 1
+        self._log({'type': 'tokens', 'model': model, 'website': website,
+                   'prompt_tokens': prompt_tokens, 'output_tokens': output_tokens})
+
+    def _log(self, record):
+        if not self.jsonl_path:
+            return
+        record['ts'] = round(time.time(), 3)
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+    # ===== Xuất số liệu =====
+    def _by_stage(self):
+        merged = {}
+        with self._lock:
+            for (stage, _), hist in self.histograms.items():
+                m = merged.setdefault(stage, Histogram())
+                m.counts = [a + b for a, b in zip(m.counts, hist.counts)]
+                m.total += hist.total
+                m.count += hist.count
+                m.errors += hist.errors
+        order = {s: i for i, s in enumerate(STAGES)}
+        return sorted(merged.items(), key=lambda item: order.get(item[0], len(order)))
+
+    def stage_summary(self):
+        """
+        [(stage, số lần, trung bình giây, p50, p95, số lỗi)] theo thứ tự STAGES
+        """
+        return [
+            (stage, hist.count, hist.total / hist.count if hist.count else 0.0,
+             hist.quantile(0.5), hist.quantile(0.95), hist.errors)
+            for stage, hist in self._by_stage()
+        ]
+
+    def summary_text(self):
+        uptime = int(time.time() - self.started_at)
+        lines = [f"📈 Thống kê pipeline ({uptime // 3600}h{uptime % 3600 // 60:02d}m từ lúc khởi động)"]
+        stages = self.stage_summary()
+        if not stages:
+            lines.append("Chưa có số liệu.")
+        for stage, count, avg, p50, p95, errors in stages:
+            lines.append(f"• {stage}: {count} lần, tb {avg:.2f}s, p50≤{p50:g}s, p95≤{p95:g}s, lỗi {errors}")
+        with self._lock:
+            counters = dict(self.counters)
+            tokens = dict(self.tokens)
+        if counters:
+            lines.append("Bộ đếm:")
+            for (name, labels), n in sorted(counters.items()):
+                label_text = ", ".join(f"{k}={v}" for k, v in labels)
+                lines.append(f"• {name}{f' ({label_text})' if label_text else ''}: {n}")
+        if tokens:
+            by_model, by_site = {}, {}
+            for (model, website), (p, o, calls) in tokens.items():
+                for bucket, key in ((by_model, model), (by_site, website or '-')):
+                    agg = bucket.setdefault(key, [0, 0, 0])
+                    agg[0] += p
+                    agg[1] += o
+                    agg[2] += calls
+            lines.append("Token theo model:")
+            lines += [f"• {m}: {c} lần, {p} vào / {o} ra" for m, (p, o, c) in sorted(by_model.items())]
+            lines.append("Token theo website:")
+            lines += [f"• {w}: {c} lần, {p} vào / {o} ra" for w, (p, o, c) in sorted(by_site.items())]
+        return "\n".join(lines)
+
+    def to_prometheus(self):
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        out = [
+            "# TYPE pipeline_stage_seconds histogram",
+        ]
+        with self._lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+            tokens = list(self.tokens.items())
+        for (stage, labels), hist in histograms:
+            base = (('stage', stage),) + labels
+            cumulative = 0
+            for bound, n in zip(BUCKETS, hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                out.append(f"pipeline_stage_seconds_bucket{fmt_labels(base, (('le', le),))} {cumulative}")
+            out.append(f"pipeline_stage_seconds_sum{fmt_labels(base)} {hist.total:.6f}")
+            out.append(f"pipeline_stage_seconds_count{fmt_labels(base)} {hist.count}")
+            out.append(f"pipeline_stage_errors_total{fmt_labels(base)} {hist.errors}")
+        out.append("# TYPE pipeline_events_total counter")
+        for (name, labels), n in counters:
+            out.append(f"pipeline_events_total{fmt_labels((('name', name),) + labels)} {n}")
+        out.append("# TYPE gemini_tokens_total counter")
+        for (model, website), (p, o, calls) in tokens:
+            base = (('model', model), ('website', website))
+            out.append(f"gemini_tokens_total{fmt_labels(base, (('kind', 'prompt'),))} {p}")
+            out.append(f"gemini_tokens_total{fmt_labels(base, (('kind', 'output'),))} {o}")
+            out.append(f"gemini_calls_total{fmt_labels(base)} {calls}")
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path=METRICS_PROM_FILE):
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,233 @@
+import asyncio
+import html
+import logging
+import os
+import time
+from telegram.error import BadRequest, RetryAfter, TimedOut, NetworkError
+from metrics import metrics
+
+NOTIFY_INTERVAL = float(os.getenv('NOTIFY_INTERVAL', '5'))
+NOTIFY_DIGEST_INTERVAL = float(os.getenv('NOTIFY_DIGEST_INTERVAL', '30'))
+NOTIFY_RATE = float(os.getenv('NOTIFY_RATE', '1'))  # số request Telegram / giây cho mỗi chat
+NOTIFY_BURST = int(os.getenv('NOTIFY_BURST', '3'))
+
+# Các mốc hiển thị trên tin nhắn tiến độ, theo thứ tự
+STAGE_LABELS = {
+    'teams': 'tên đội',
+    'post': 'bài viết',
+    'images': 'ảnh',
+    'published': 'đăng bài',
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _fmt_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ProgressNotifier:
+    """
+    Gom tiến độ một job vào một tin nhắn duy nhất, cập nhật bằng edit_message_text theo chu kỳ (debounce).
+    Lỗi được gom thành bản tin định kỳ. Các hàm báo tiến độ chỉ cập nhật state trong RAM,
+    việc gửi Telegram chạy ở task nền (token bucket + tôn trọng RetryAfter) nên pipeline không phải chờ.
+    """
+
+    def __init__(self, bot, chat_id, title, total=None, interval=NOTIFY_INTERVAL,
+                 digest_interval=NOTIFY_DIGEST_INTERVAL, rate=NOTIFY_RATE, burst=NOTIFY_BURST):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.title = title
+        self.total = total
+        self.interval = interval
+        self.digest_interval = digest_interval
+        self.bucket = TokenBucket(rate, burst)
+        self.started_at = time.monotonic()
+        self.running = set()
+        self.stage_counts = {stage: 0 for stage in STAGE_LABELS}
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_link = None
+        self.errors = []
+        self.messages = []
+        self.message_id = None
+        self._dirty = True
+        self._last_digest = time.monotonic()
+        self._task = None
+        self._wake = asyncio.Event()
+        self._closing = False
+
+    # ===== Các hàm pipeline gọi (không chờ Telegram) =====
+    def row_started(self, row_number):
+        self.running.add(row_number)
+        self._touch()
+
+    def stage(self, row_number, stage):
+        if stage in self.stage_counts:
+            self.stage_counts[stage] += 1
+        self._touch()
+
+    def row_done(self, row_number, link):
+        self.running.discard(row_number)
+        self.done += 1
+        self.last_link = link
+        self._touch()
+
+    def row_skipped(self, row_number, reason=None):
+        self.running.discard(row_number)
+        self.skipped += 1
+        if reason:
+            self.errors.append(f"[Dòng {row_number}] {reason}")
+        self._touch()
+
+    def row_failed(self, row_number, error):
+        self.running.discard(row_number)
+        self.failed += 1
+        self.errors.append(f"[Dòng {row_number}] {error}")
+        self._touch()
+
+    def error(self, row_number, error):
+        self.errors.append(f"[Dòng {row_number}] {error}")
+
+    def info(self, text):
+        """
+        Tin nhắn riêng (không gộp vào tin tiến độ), gửi ở task nền
+        """
+        self.messages.append(text)
+        self._wake.set()
+
+    def _touch(self):
+        self._dirty = True
+
+    # ===== Gửi Telegram =====
+    def render(self):
+        finished = self.done + self.skipped + self.failed
+        elapsed = time.monotonic() - self.started_at
+        lines = [f"📊 <b>{html.escape(self.title)}</b>"]
+        total = f"/{self.total}" if self.total else ""
+        lines.append(f"Đã xong {finished}{total} dòng | Đang chạy: {len(self.running)}")
+        lines.append(f"✅ Đã đăng: {self.done} | ⏭ Bỏ qua: {self.skipped} | ❌ Lỗi: {self.failed}")
+        lines.append("Mốc: " + " · ".join(f"{label} {self.stage_counts[s]}" for s, label in STAGE_LABELS.items()))
+        eta = ""
+        if self.total and finished and finished < self.total:
+            eta = f", còn khoảng {_fmt_duration(elapsed / finished * (self.total - finished))}"
+        lines.append(f"⏱ {_fmt_duration(elapsed)}{eta}")
+        if self.last_link:
+            lines.append(f"🔗 Bài mới nhất: {html.escape(self.last_link)}")
+        return "\n".join(lines)
+
+    async def _call(self, func, *args, **kwargs):
+        for attempt in range(5):
+            if attempt:
+                metrics.inc('telegram_retries')
+            await self.bucket.acquire()
+            try:
+                with metrics.timer('telegram'):
+                    return await func(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logging.warning("Telegram flood control, chờ %ss", retry_after)
+                await asyncio.sleep(retry_after)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return None
+                if "parse entities" in str(e).lower() and kwargs.get('parse_mode'):
+                    # HTML hỏng (vd. text ngoài chưa escape): gửi lại dạng text thường thay vì bỏ mất tin
+                    logging.warning("Telegram không parse được HTML, gửi lại không parse_mode: %s", e)
+                    kwargs = {k: v for k, v in kwargs.items() if k != 'parse_mode'}
+                    continue
+                logging.warning("Telegram BadRequest: %s", e)
+                return None
+            except (TimedOut, NetworkError) as e:
+                logging.warning("Telegram lỗi mạng: %s", e)
+                await asyncio.sleep(2)
+        return None
+
+    async def _flush_progress(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        text = self.render()
+        if self.message_id is None:
+            msg = await self._call(self.bot.send_message, self.chat_id, text, parse_mode="HTML")
+            if msg is not None:
+                self.message_id = msg.message_id
+        else:
+            await self._call(self.bot.edit_message_text, text, chat_id=self.chat_id,
+                             message_id=self.message_id, parse_mode="HTML")
+
+    async def _flush_digest(self):
+        self._last_digest = time.monotonic()
+        if not self.errors:
+            return
+        errors, self.errors = self.errors, []
+        body = "\n".join(html.escape(e[:500]) for e in errors)
+        await self._call(self.bot.send_message, self.chat_id,
+                         f"⚠️ <b>{len(errors)} lỗi mới</b>:\n{body}"[:4000], parse_mode="HTML")
+
+    async def _flush_messages(self):
+        while self.messages:
+            await self._call(self.bot.send_message, self.chat_id, self.messages[0][:4000], parse_mode="HTML")
+            self.messages.pop(0)
+
+    async def _run(self):
+        # Dừng bằng cờ _closing chứ không cancel: wait_for của Python 3.11 có thể nuốt lệnh cancel
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._closing:
+                break
+            try:
+                await self._flush_messages()
+                await self._flush_progress()
+                if time.monotonic() - self._last_digest >= self.digest_interval:
+                    await self._flush_digest()
+            except Exception:
+                logging.exception("ProgressNotifier lỗi khi gửi Telegram")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, final_text=None):
+        """
+        Dừng task nền, gửi nốt tiến độ, lỗi và tin nhắn còn lại
+        """
+        self._closing = True
+        self._wake.set()
+        if self._task:
+            # Chờ task nền tự thoát (xong lượt gửi đang dở, nếu có)
+            await self._task
+            self._task = None
+        self._dirty = True
+        await self._flush_messages()
+        await self._flush_progress()
+        await self._flush_digest()
+        if final_text:
+            await self._call(self.bot.send_message, self.chat_id, final_text, parse_mode="HTML")
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple, Optional, Tuple
+
+# Mỗi worker (spawn) nạp lại module chính (bot.py thành __mp_main__) + Pillow, ~60MB RSS mỗi process:
+# mặc định tối đa 2 worker để vừa RAM của dyno, máy nhiều RAM thì tăng bằng RENDER_WORKERS
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '0')) or min(os.cpu_count() or 1, 2)
+
+
+class RenderJob(NamedTuple):
+    bg_url: str
+    text: str
+    size: Optional[Tuple[int, int]] = None  # None = image_generator.IMG_SIZE
+    quality: int = 95
+
+
+# image_generator (Pillow) chỉ được import trong process render, process bot không phải nạp lúc khởi động
+def _init_worker(warm_backgrounds):
+    from image_generator import load_background, warm_fonts
+    # Mỗi process tự nạp sẵn font + ảnh nền vào cache riêng của nó
+    warm_fonts()
+    for url in warm_backgrounds:
+        try:
+            load_background(url)
+        except Exception as e:
+            logging.warning("Không tải trước được ảnh nền %s: %s", url, e)
+
+def _render(job):
+    from image_generator import IMG_SIZE, render_image
+    return render_image(job.bg_url, job.text, quality=job.quality, size=job.size or IMG_SIZE)
+
+
+class RenderPool:
+    """
+    Pool process render ảnh (Pillow vẽ chữ + encode JPEG là việc CPU), mặc định RENDER_WORKERS process.
+    Nhận RenderJob, trả về bytes JPEG. Worker chết (OOM / bị kill) làm hỏng pool thì tự tạo pool mới.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, warm_backgrounds=()):
+        self.workers = workers
+        self.warm_backgrounds = tuple(warm_backgrounds)
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.warm_backgrounds,),
+        )
+
+    def _restart(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                logging.warning("Pool render bị hỏng (worker chết), tạo pool mới")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            return self._executor
+
+    def submit(self, job):
+        executor = self._executor
+        try:
+            return executor.submit(_render, job)
+        except BrokenProcessPool:
+            return self._restart(executor).submit(_render, job)
+
+    async def render(self, job):
+        try:
+            return await asyncio.wrap_future(self.submit(job))
+        except BrokenProcessPool:
+            # Job đang chạy lúc pool hỏng: thử lại một lần trên pool mới
+            return await asyncio.wrap_future(self.submit(job))
+
+    def map(self, jobs):
+        return list(self._executor.map(_render, jobs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool = None
+
+def get_render_pool(warm_backgrounds=()):
+    """
+    Pool dùng chung cho bot, tạo ở lần gọi đầu (ảnh nền truyền ở lần đó được tải sẵn trong mỗi worker)
+    """
+    global _pool
+    if _pool is None:
+        _pool = RenderPool(warm_backgrounds=warm_backgrounds)
+    return _pool
+
+
+def _sheet_texts(file_path):
+    """
+    Yield (dòng, ảnh nền, [(tên file, text)]) cho các dòng đã có H1/H2 trong job journal hoặc cache Gemini
+    """
+    from excel_reader import read_accounts, iter_keywords, normalize_website
+    from job_journal import get_journal, file_hash, reached
+    from result_cache import get_cache
+    from content_writer import _cache_parts
+    from html_post import slugify
+
+    accounts = read_accounts(file_path)
+    fhash = file_hash(file_path)
+    journal = get_journal()
+    cache = get_cache()
+    for row in iter_keywords(file_path):
+        account = accounts.get(normalize_website(row.website))
+        if row.error or account is None:
+            continue
+        stage, state = journal.get(fhash, row.row_number - 2)
+        h1_title, h2s = None, []
+        if reached(stage, 'post'):
+            h1_title, h2s = state['h1'], state['h2s']
+        elif cache:
+            parts = _cache_parts(row.src_url, row.anchor_text, row.anchor_url)
+            bundle = cache.get('bundle', parts)
+            post = cache.get('post', parts)
+            if bundle:
+                h1_title, h2s = bundle['h1'], bundle['h2s']
+            elif post:
+                h1_title, h2s = post[0], post[1]
+        if not h1_title:
+            yield row.row_number, account.background, []
+            continue
+        images = [(f"dong{row.row_number}-thumbnail-{slugify(h1_title)}.jpg", h1_title)]
+        if h2s:
+            images.append((f"dong{row.row_number}-{slugify(h2s[0])}.jpg", h2s[0]))
+            images.append((f"dong{row.row_number}-{slugify(h2s[-1])}.jpg", h2s[-1]))
+        yield row.row_number, account.background, images
+
+def prerender_sheet(file_path, out_dir, workers=RENDER_WORKERS):
+    """
+    Render trước toàn bộ ảnh của một file Excel ra out_dir (chỉ các dòng đã có bài trong journal / cache)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    names, jobs, skipped, backgrounds = [], [], [], set()
+    for row_number, bg_url, images in _sheet_texts(file_path):
+        if not images:
+            skipped.append(row_number)
+        for name, text in images:
+            names.append(name)
+            jobs.append(RenderJob(bg_url, text))
+            backgrounds.add(bg_url)
+    pool = RenderPool(workers, warm_backgrounds=backgrounds)
+    try:
+        started = time.perf_counter()
+        for name, data in zip(names, pool.map(jobs)):
+            with open(os.path.join(out_dir, name), 'wb') as f:
+                f.write(data)
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.shutdown()
+    print(f"Đã render {len(jobs)} ảnh vào {out_dir} trong {elapsed:.1f}s ({workers} worker)")
+    if skipped:
+        print(f"Bỏ qua {len(skipped)} dòng chưa có bài viết: {skipped}")
+
+def benchmark(bg_url, jobs=60, worker_counts=(1, 2, 4)):
+    text = "Nhận định bóng đá Manchester United vs Liverpool ngày 25/12/2025"
+    batch = [RenderJob(bg_url, f"{text} #{i}") for i in range(jobs)]
+    for workers in worker_counts:
+        pool = RenderPool(workers, warm_backgrounds=[bg_url])
+        try:
+            pool.map(batch[:workers])  # chờ các worker khởi động + warm cache
+            started = time.perf_counter()
+            pool.map(batch)
+            elapsed = time.perf_counter() - started
+        finally:
+            pool.shutdown()
+        print(f"{workers} worker: {jobs / elapsed:.1f} ảnh/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render ảnh hàng loạt bằng pool process")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sheet = sub.add_parser("sheet", help="render trước ảnh của một file Excel")
+    p_sheet.add_argument("file")
+    p_sheet.add_argument("out_dir")
+    p_sheet.add_argument("--workers", type=int, default=RENDER_WORKERS)
+    p_bench = sub.add_parser("bench", help="đo số ảnh/giây theo số worker")
+    p_bench.add_argument("bg_url")
+    p_bench.add_argument("--jobs", type=int, default=60)
+    p_bench.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, RENDER_WORKERS])
+    args = parser.parse_args()
+    if args.command == "sheet":
+        prerender_sheet(args.file, args.out_dir, args.workers)
+    else:
+        benchmark(args.bg_url, args.jobs, sorted(set(args.workers)))
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.getenv('RESULT_CACHE_PATH', 'cache/results.sqlite3')
+CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '5000'))
+
+
+class ResultCache:
+    """
+    Cache kết quả Gemini trên đĩa (SQLite), key = hash của (loại, url nguồn, anchor, prompt version, model...).
+    Có TTL và giới hạn số entry (xoá entry ít dùng nhất khi vượt).
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, kind TEXT, source_url TEXT,"
+            " created REAL, accessed REAL, value TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_source ON results(source_url)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed ON results(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(kind, parts):
+        raw = json.dumps([kind, parts], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, kind, parts):
+        key = self.make_key(kind, parts)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT created, value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[0] > self.ttl):
+                if row is not None:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[1])
+
+    def set(self, kind, parts, value, source_url=""):
+        key = self.make_key(kind, parts)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, kind, source_url, created, accessed, value) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, source_url, now, now, json.dumps(value, ensure_ascii=False)),
+            )
+            if self.max_entries:
+                # Vượt giới hạn thì xoá các entry truy cập lâu nhất
+                self._conn.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    " SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def purge(self, source_url=None):
+        """
+        Xoá toàn bộ cache, hoặc chỉ các entry của một url nguồn. Trả về số entry đã xoá
+        """
+        with self._lock:
+            if source_url:
+                cur = self._conn.execute("DELETE FROM results WHERE source_url = ?", (source_url,))
+            else:
+                cur = self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+            return cur.rowcount
+
+    def purge_expired(self):
+        if not self.ttl:
+            return 0
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def entries(self, source_url=None, limit=20):
+        """
+        Trả về list (kind, source_url, created, accessed) mới nhất, lọc theo url nguồn nếu có
+        """
+        with self._lock:
+            if source_url:
+                rows = self._conn.execute(
+                    "SELECT kind, source_url, created, accessed FROM results WHERE source_url = ?"
+                    " ORDER BY accessed DESC LIMIT ?", (source_url, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT kind, source_url, created, accessed FROM results ORDER BY accessed DESC LIMIT ?", (limit,)
+                ).fetchall()
+        return rows
+
+    def stats(self):
+        with self._lock:
+            by_kind = dict(self._conn.execute("SELECT kind, COUNT(*) FROM results GROUP BY kind").fetchall())
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {
+            'entries': sum(by_kind.values()),
+            'by_kind': by_kind,
+            'size_bytes': size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """
+    Cache dùng chung cho cả process (None nếu tắt bằng RESULT_CACHE_PATH rỗng)
+    """
+    global _cache
+    if not CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
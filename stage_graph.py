@@ -0,0 +1,57 @@
+import asyncio
+import inspect
+import logging
+import time
+
+
+class StageGraph:
+    """
+    Đồ thị phụ thuộc nhỏ cho các bước của một bài viết.
+    Mỗi stage là hàm async nhận kết quả của các stage nó phụ thuộc (theo tên, dạng keyword),
+    stage nào đủ điều kiện thì chạy ngay, các stage độc lập chạy song song.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.stages = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' phụ thuộc stage chưa khai báo: '{dep}'")
+        self.stages[name] = (func, tuple(deps))
+        return self
+
+    async def _run_stage(self, name, tasks):
+        func, deps = self.stages[name]
+        inputs = {}
+        for dep in deps:
+            inputs[dep] = await tasks[dep]
+        started = time.perf_counter()
+        result = func(**inputs)
+        if inspect.isawaitable(result):
+            result = await result
+        self.timings[name] = time.perf_counter() - started
+        return result
+
+    async def run(self):
+        """
+        Chạy toàn bộ đồ thị, trả về {tên stage: kết quả}. Một stage lỗi thì huỷ các stage còn lại và raise lại lỗi đó.
+        """
+        tasks = {}
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(self._run_stage(name, tasks))
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            total = time.perf_counter() - started
+            timings = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+            logging.info("%s stage timings (tổng %.2fs): %s", self.name, total, timings)
+        return {name: task.result() for name, task in tasks.items()}
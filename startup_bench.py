@@ -0,0 +1,114 @@
+"""
+Đo thời gian import + RAM của worker (import bot) trong process mới, như lúc dyno khởi động lại.
+
+    python startup_bench.py               # in thời gian import, RSS và các module import chậm nhất
+    python startup_bench.py --check       # exit 1 nếu import bot kéo theo module nặng / vượt ngân sách thời gian
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Module chỉ cần khi có file Excel, không được nạp lúc import bot (được nạp nền bởi bot._warm_up)
+HEAVY_MODULES = (
+    'PIL', 'openpyxl', 'google.generativeai', 'markdown2',
+    'pandas', 'numpy', 'bs4', 'lxml', 'html5lib',
+)
+
+_CHILD = r"""
+import json, sys, time
+started = time.perf_counter()
+import bot
+seconds = time.perf_counter() - started
+rss_kb = 0
+try:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'seconds': seconds, 'rss_kb': rss_kb}))
+"""
+
+
+def _parse_importtime(stderr):
+    """
+    [(module, cumulative µs, độ sâu)] từ output của -X importtime
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(cumulative), depth))
+    return modules
+
+def _children(modules, parent='bot'):
+    """
+    Các module parent import trực tiếp (độ sâu 1). -X importtime in module con trước module cha
+    """
+    pending = []
+    for name, cumulative, depth in modules:
+        if depth == 1:
+            pending.append((name, cumulative, depth))
+        elif depth == 0:
+            if name == parent:
+                return pending
+            pending = []
+    return []
+
+def measure():
+    """
+    Chạy một process mới import bot, trả về (giây import, RSS KB, danh sách module từ -X importtime)
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _CHILD],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import bot lỗi:\n{proc.stderr[-3000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return result['seconds'], result['rss_kb'], _parse_importtime(proc.stderr)
+
+def heavy_imports(modules):
+    names = {name for name, _, _ in modules}
+    return sorted(m for m in HEAVY_MODULES if m in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo thời gian khởi động (import bot) và RAM của worker")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="số module import chậm nhất cần in")
+    parser.add_argument("--check", action="store_true", help="kiểm tra hồi quy: không module nặng, trong ngân sách")
+    parser.add_argument("--budget-ms", type=float, default=1500, help="ngân sách thời gian import (trung vị) cho --check")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.runs))]
+    seconds = statistics.median(r[0] for r in runs)
+    rss_mb = statistics.median(r[1] for r in runs) / 1024
+    modules = runs[-1][2]
+    print(f"import bot: trung vị {seconds * 1000:.0f} ms qua {len(runs)} lần, RSS {rss_mb:.1f} MB")
+    children = sorted(_children(modules), key=lambda m: m[1], reverse=True)
+    print(f"{args.top} module bot import trực tiếp chậm nhất:")
+    for name, cumulative, _ in children[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    heavy = heavy_imports(modules)
+    if heavy:
+        print(f"Module nặng bị import lúc khởi động: {', '.join(heavy)}")
+    if args.check:
+        failed = bool(heavy) or seconds * 1000 > args.budget_ms
+        if seconds * 1000 > args.budget_ms:
+            print(f"Vượt ngân sách: {seconds * 1000:.0f} ms > {args.budget_ms:.0f} ms")
+        print("FAIL" if failed else "OK")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,219 @@
+import html
 import requests
 import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+from metrics import metrics
 
-def upload_featured_image(wp_url, username, password, img_path, alt_text):
+WP_TIMEOUT = float(os.getenv('WP_TIMEOUT', '60'))
+WP_RETRIES = int(os.getenv('WP_RETRIES', '4'))
+WP_POOL_SIZE = int(os.getenv('WP_POOL_SIZE', '8'))
+
+
+class _WPRetry(Retry):
     """
-    Upload ảnh lên WP, trả về ID (dùng cho featured_media) và URL (để chèn vào bài viết)
+    GET: thử lại lỗi đọc / 429 / 5xx như bình thường.
+    POST (đăng bài, upload) không idempotent: chỉ thử lại lỗi kết nối (request chưa tới server)
+    và 429/503 có Retry-After (server báo chưa xử lý). Timeout đọc / 500 / 502 / 504 không thử lại,
+    vì bài / ảnh có thể đã được tạo.
     """
-    media_api = wp_url.rstrip('/') + "/wp-json/wp/v2/media"
-    with open(img_path, 'rb') as img_file:
-        files = {'file': (os.path.basename(img_path), img_file, 'image/jpeg')}
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method and method.upper() == 'POST':
+            return bool(self.total and has_retry_after and status_code in (429, 503))
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class WordPressClient:
+    """
+    Client REST WordPress cho một website + tài khoản.
+    Dùng chung một requests.Session (keep-alive) nên các lần upload/đăng bài
+    tái sử dụng kết nối TLS; có timeout và tự retry với backoff (POST chỉ retry khi chắc chắn chưa được xử lý).
+    """
+
+    def __init__(self, wp_url, username, password, timeout=WP_TIMEOUT, retries=WP_RETRIES, pool_size=WP_POOL_SIZE):
+        self.wp_url = wp_url.rstrip('/')
+        self.api_base = self.wp_url + "/wp-json/wp/v2"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, password)
+        retry = _WPRetry(
+            total=retries,
+            backoff_factor=1,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # không gồm POST: lỗi đọc của POST không thử lại
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _count_retries(self, resp):
+        retries = getattr(resp.raw, 'retries', None)
+        if retries is not None:
+            metrics.inc('wp_retries', len(retries.history), website=self.wp_url)
+
+    def upload_media(self, image, alt_text, file_name=None):
+        """
+        Upload ảnh lên WP, trả về (ID, source_url) lấy thẳng từ response upload.
+        image là bytes, file-like (BytesIO...) hoặc đường dẫn file; file_name là tên file trên WP
+        """
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, 'rb') as img_file:
+                return self.upload_media(img_file.read(), alt_text, file_name or os.path.basename(image))
+        if hasattr(image, 'read'):
+            file_name = file_name or os.path.basename(getattr(image, 'name', '') or '')
+            image = image.read()
+        files = {'file': (file_name or 'image.jpg', image, 'image/jpeg')}
         data = {'alt_text': alt_text}
-        resp = requests.post(
-            media_api, 
-            files=files, 
-            data=data, 
-            auth=(username, password)
+        resp = self.session.post(self.api_base + "/media", files=files, data=data, timeout=self.timeout)
+        self._count_retries(resp)
+        resp.raise_for_status()
+        resp_json = resp.json()
+        return resp_json['id'], resp_json.get('source_url')
+
+    def get_media_url(self, media_id):
+        """
+        Lấy URL của media (dùng ID vừa upload)
+        """
+        resp = self.session.get(self.api_base + f"/media/{media_id}", timeout=self.timeout)
+        self._count_retries(resp)
+        resp.raise_for_status()
+        return resp.json().get('source_url')
+
+    def create_post(self, html_content, category_id, title, featured_media_id=None):
+        """
+        Đăng bài lên WP. Trả về link bài viết
+        """
+        post = {
+            "title": title,
+            "content": html_content,
+            "status": "publish",
+            "categories": [int(category_id)]
+        }
+        if featured_media_id:
+            post["featured_media"] = featured_media_id
+        try:
+            resp = self.session.post(self.api_base + "/posts", json=post, timeout=self.timeout)
+        except requests.exceptions.ReadTimeout:
+            # Request đã tới server, bài có thể đã được tạo: tìm lại trước khi báo lỗi (tránh đăng trùng khi chạy lại)
+            link = self.find_post(title)
+            if link:
+                return link
+            raise
+        self._count_retries(resp)
+        resp.raise_for_status()
+        return resp.json().get('link')
+
+    def find_post(self, title):
+        """
+        Link bài mới nhất có đúng tiêu đề title, None nếu không có
+        """
+        resp = self.session.get(
+            self.api_base + "/posts",
+            params={"search": title, "per_page": 5, "orderby": "date", "context": "edit"},
+            timeout=self.timeout,
         )
-    resp.raise_for_status()
-    resp_json = resp.json()
-    return resp_json['id']
+        self._count_retries(resp)
+        resp.raise_for_status()
+        for item in resp.json():
+            rendered = item.get('title', {})
+            if title in (rendered.get('raw'), html.unescape(rendered.get('rendered') or '')):
+                return item.get('link')
+        return None
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(wp_url, username, password):
+    """
+    Trả về WordPressClient dùng chung cho mỗi (website, tài khoản), tạo một lần duy nhất
+    """
+    key = (wp_url.rstrip('/'), username, password)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = WordPressClient(wp_url, username, password)
+        return client
+
+def upload_featured_image(wp_url, username, password, image, alt_text, file_name=None):
+    """
+    Upload ảnh (bytes, file-like hoặc đường dẫn) lên WP, trả về ID (dùng cho featured_media)
+    """
+    media_id, _ = get_client(wp_url, username, password).upload_media(image, alt_text, file_name)
+    return media_id
 
 def get_media_url(wp_url, media_id, username=None, password=None):
     """
     Lấy URL của media (dùng ID vừa upload)
     """
-    media_api = wp_url.rstrip('/') + f"/wp-json/wp/v2/media/{media_id}"
     if username and password:
-        resp = requests.get(media_api, auth=(username, password))
-    else:
-        resp = requests.get(media_api)
+        return get_client(wp_url, username, password).get_media_url(media_id)
+    resp = requests.get(wp_url.rstrip('/') + f"/wp-json/wp/v2/media/{media_id}", timeout=WP_TIMEOUT)
     resp.raise_for_status()
-    resp_json = resp.json()
-    return resp_json.get('source_url')
+    return resp.json().get('source_url')
 
 def post_to_wordpress(wp_url, username, password, html_content, category_id, title, featured_media_id=None):
     """
     Đăng bài lên WP. Trả về link bài viết
     """
-    api_url = wp_url.rstrip('/') + "/wp-json/wp/v2/posts"
-    post = {
-        "title": title,
-        "content": html_content,
-        "status": "publish",
-        "categories": [int(category_id)]
-    }
-    if featured_media_id:
-        post["featured_media"] = featured_media_id
-    resp = requests.post(api_url, auth=HTTPBasicAuth(username, password), json=post)
-    resp.raise_for_status()
-    return resp.json().get('link')
+    return get_client(wp_url, username, password).create_post(html_content, category_id, title, featured_media_id)
+
+
+def _legacy_article(wp_url, username, password, images):
+    """
+    Luồng cũ (trước WordPressClient): mỗi request một kết nối mới, thêm GET media để lấy URL ảnh 2/3
+    """
+    auth = (username, password)
+    api = wp_url.rstrip('/') + "/wp-json/wp/v2"
+    media_ids = []
+    for i, data in enumerate(images):
+        resp = requests.post(api + "/media", files={'file': (f"{i}.jpg", data, 'image/jpeg')},
+                             data={'alt_text': 'alt'}, auth=auth)
+        resp.raise_for_status()
+        media_ids.append(resp.json()['id'])
+    for media_id in media_ids[1:]:
+        requests.get(api + f"/media/{media_id}", auth=auth).raise_for_status()
+    post = {"title": "t", "content": "<p>x</p>", "status": "publish", "categories": [1], "featured_media": media_ids[0]}
+    requests.post(api + "/posts", auth=HTTPBasicAuth(username, password), json=post).raise_for_status()
+
+def _client_article(wp_url, username, password, images):
+    client = get_client(wp_url, username, password)
+    media = [client.upload_media(data, 'alt', f"{i}.jpg") for i, data in enumerate(images)]
+    client.create_post("<p>x</p>", 1, "t", featured_media_id=media[0][0])
+
+def _benchmark(articles=20, sites=2):
+    """
+    Đếm kết nối TCP + số request mỗi bài (3 ảnh + 1 bài) trên server WP giả, luồng cũ và WordPressClient
+    """
+    from dry_run import start_stub_server
+    images = [b"\xff\xd8" + os.urandom(60_000)] * 3
+    for name, article in (("luồng cũ", _legacy_article), ("WordPressClient", _client_article)):
+        server, base_url = start_stub_server()
+        try:
+            started = time.perf_counter()
+            for i in range(articles):
+                article(f"{base_url}/site{i % sites}.example", "admin", "pass", images)
+            elapsed = time.perf_counter() - started
+        finally:
+            server.shutdown()
+        round_trips = sum(server.requests.values())
+        print(f"{name}: {server.connections / articles:.2f} kết nối/bài, {round_trips / articles:.2f} request/bài "
+              f"({', '.join(f'{k} {v}' for k, v in sorted(server.requests.items()))}), {elapsed * 1000 / articles:.1f} ms/bài")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Đếm kết nối / request mỗi bài trên server WP giả")
+    parser.add_argument("--articles", type=int, default=20)
+    parser.add_argument("--sites", type=int, default=2)
+    args = parser.parse_args()
+    _benchmark(args.articles, args.sites)